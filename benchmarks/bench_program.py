@@ -0,0 +1,249 @@
+"""Benchmark the construction of the stacks' Pulumi programs against node count.
+
+The program in `__main__.py` is executed under Pulumi runtime mocks, so no
+AWS account or Pulumi backend is needed. Each measurement runs in its own
+subprocess against a scratch copy of the project directory and reports wall
+time, peak memory, the number of registered resources and Outputs.
+
+    python benchmarks/bench_program.py                      # both stacks, 2/10/100/500 nodes
+    python benchmarks/bench_program.py ha-slurm-launcher --nodes 2 10 100
+
+Results are compared against `benchmarks/baseline.json`; the run fails if a
+measurement regresses (see `--tolerance`). Refresh the baseline with
+`--save-baseline` after an intentional change.
+
+The number of Outputs also depends on the Pulumi SDK, which creates Outputs
+of its own. The baseline records the SDK version it was taken with; with
+another version the Output count only has to stay within
+`--output-tolerance` of the baseline.
+
+With `--check-linear` the run also fails if the number of Outputs registered
+per additional node grows with the node count, i.e. if program construction
+is no longer O(n).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.metadata import version
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# Config key that scales the number of nodes for each stack.
+NODE_COUNT_KEY = {
+    "ha-slurm-launcher": "slurmComputeNodeServerNumber",
+    "ha-local-launcher": "pwbServerNumber",
+}
+
+# Required config values that have no default in Pulumi.yaml.
+EXTRA_CONFIG = {
+    "email": "bench@example.org",
+    "public_key": "ssh-rsa AAAA bench",
+    "rsw_license": "bench-license",
+}
+
+# Graph sizes are deterministic and compared exactly (Outputs only with the
+# baseline's SDK version); time and memory depend on the machine and are
+# compared with a tolerance factor.
+EXACT_METRICS = ["resources", "outputs"]
+SDK_DEPENDENT_METRICS = ["outputs"]
+NOISY_METRICS = ["seconds", "peak_rss_mib"]
+
+
+def stack_config(project_dir: Path, nodes: int) -> tuple:
+    """Project name and Pulumi config for `project_dir` with `nodes` scaled nodes."""
+    with open(project_dir / "Pulumi.yaml") as f:
+        project = yaml.safe_load(f)
+    values = {k: v.get("default") for k, v in project.get("config", {}).items()}
+    values |= EXTRA_CONFIG
+    values[NODE_COUNT_KEY[project_dir.name]] = nodes
+    name = project["name"]
+    return name, {f"{name}:{k}": str(v) for k, v in values.items()}
+
+
+# ------------------------------------------------------------------------------
+# Worker: runs inside the subprocess
+# ------------------------------------------------------------------------------
+
+def run_worker(project_dir: Path, nodes: int) -> dict:
+    import pulumi
+
+    resources = 0
+
+    class Mocks(pulumi.runtime.Mocks):
+        def new_resource(self, args: pulumi.runtime.MockResourceArgs):
+            nonlocal resources
+            resources += 1
+            outputs = dict(args.inputs)
+            outputs.setdefault("privateDns", f"ip-{abs(hash(args.name)) % 10**8}.ec2.internal")
+            outputs.setdefault("publicDns", f"{args.name}.compute.amazonaws.com")
+            outputs.setdefault("publicIp", "203.0.113.10")
+            outputs.setdefault("address", f"{args.name}.rds.amazonaws.com")
+            outputs.setdefault("dnsIpAddresses", ["172.31.0.2", "172.31.0.3"])
+            return [f"{args.name}_id", outputs]
+
+        def call(self, args: pulumi.runtime.MockCallArgs):
+            if args.token in ("aws:ec2/getSubnetIds:getSubnetIds", "aws:ec2/getSubnets:getSubnets"):
+                return {"ids": ["subnet-1", "subnet-2", "subnet-3"]}
+            if args.token == "aws:ec2/getSubnet:getSubnet":
+                return {"id": "subnet-1", "cidrBlock": "172.31.0.0/20"}
+            return {"id": "vpc-1"}
+
+    project, config = stack_config(project_dir, nodes)
+
+    # Every Output registers itself through `_track` (older SDKs only go
+    # through `__init__`), so counting those calls counts the graph's Outputs.
+    outputs = 0
+    hook = "_track" if hasattr(pulumi.Output, "_track") else "__init__"
+    original = getattr(pulumi.Output, hook)
+
+    def counting(self, *args, **kwargs):
+        nonlocal outputs
+        outputs += 1
+        return original(self, *args, **kwargs)
+
+    setattr(pulumi.Output, hook, counting)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp) / project_dir.name
+        shutil.copytree(project_dir, workdir, ignore=shutil.ignore_patterns("venv", "__pycache__"))
+        (workdir / "key.pem").write_text("bench-private-key")
+        os.environ.setdefault("RSW_LICENSE", EXTRA_CONFIG["rsw_license"])
+        os.chdir(workdir)
+        sys.path.insert(0, str(workdir))
+
+        pulumi.runtime.set_mocks(Mocks(), project=project, stack="bench", preview=False)
+        pulumi.runtime.set_all_config(config)
+
+        start = time.perf_counter()
+        runpy.run_path("__main__.py", run_name="__main__")
+        asyncio.get_event_loop().run_until_complete(pulumi.runtime.stack.wait_for_rpcs())
+        elapsed = time.perf_counter() - start
+
+    from templating import template_cache
+    return {
+        "project": project_dir.name,
+        "nodes": nodes,
+        "seconds": round(elapsed, 4),
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "resources": resources,
+        "outputs": outputs,
+        "template_cache_hits": template_cache.hits,
+        "template_cache_misses": template_cache.misses,
+    }
+
+
+# ------------------------------------------------------------------------------
+# Driver
+# ------------------------------------------------------------------------------
+
+def measure(project_dir: Path, nodes: int) -> dict:
+    proc = subprocess.run(
+        [sys.executable, __file__, str(project_dir), "--worker", "--nodes", str(nodes)],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"{project_dir.name} with {nodes} nodes failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def check_linear(results: list, tolerance: float = 1.5) -> bool:
+    """True if the Outputs added per node stay within `tolerance` across all steps."""
+    slopes = [
+        (b["outputs"] - a["outputs"]) / (b["nodes"] - a["nodes"])
+        for a, b in zip(results, results[1:])
+    ]
+    return not slopes or max(slopes) <= tolerance * min(slopes)
+
+
+def regressions(result: dict, baseline: dict, tolerance: float, output_tolerance: float) -> list:
+    """Metrics of `result` that are worse than `baseline`."""
+    found = []
+    same_sdk = baseline.get("pulumi") == version("pulumi")
+    for metric in EXACT_METRICS:
+        allowed = baseline[metric]
+        if metric in SDK_DEPENDENT_METRICS and not same_sdk:
+            allowed *= output_tolerance
+        if result[metric] > allowed:
+            found.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    for metric in NOISY_METRICS:
+        if result[metric] > baseline[metric] * tolerance:
+            found.append(f"{metric} {baseline[metric]} -> {result[metric]}")
+    return found
+
+
+def load_baseline() -> dict:
+    if not BASELINE.exists():
+        return {}
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("projects", nargs="*", default=list(NODE_COUNT_KEY),
+                        help="Pulumi project directories (default: all stacks)")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[2, 10, 100, 500])
+    parser.add_argument("--check-linear", action="store_true",
+                        help="fail if the Output count grows faster than linearly with node count")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="allowed slowdown/memory growth factor against the baseline (default: 1.5)")
+    parser.add_argument("--output-tolerance", type=float, default=1.1,
+                        help="allowed Output count growth factor against a baseline taken with "
+                             "another Pulumi SDK version (default: 1.1)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"store the results in {BASELINE.relative_to(ROOT)} instead of comparing")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker((ROOT / args.projects[0]).resolve(), args.nodes[0])))
+        return
+
+    baseline = load_baseline()
+    failures = []
+    print(f"{'project':<18} {'nodes':>6} {'seconds':>9} {'MiB':>7} {'resources':>10} {'outputs':>8}  regressions")
+    for project in args.projects:
+        project_dir = (ROOT / project).resolve()
+        results = []
+        for nodes in sorted(args.nodes):
+            r = measure(project_dir, nodes)
+            results.append(r)
+            key = f"{project_dir.name}/{nodes}"
+            found = [] if args.save_baseline or key not in baseline else regressions(
+                r, baseline[key], args.tolerance, args.output_tolerance)
+            failures += [f"{key}: {f}" for f in found]
+            print(f"{project_dir.name:<18} {nodes:>6} {r['seconds']:>9.3f} {r['peak_rss_mib']:>7.1f} "
+                  f"{r['resources']:>10} {r['outputs']:>8}  {', '.join(found)}")
+            if args.save_baseline:
+                baseline[key] = {m: r[m] for m in EXACT_METRICS + NOISY_METRICS}
+                baseline[key]["pulumi"] = version("pulumi")
+
+        if args.check_linear and not check_linear(results):
+            failures.append(f"{project_dir.name}: Output count grows faster than linearly with the number of nodes")
+
+    if args.save_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {BASELINE.relative_to(ROOT)}")
+
+    if failures:
+        sys.exit("\n".join(["regressions against the baseline:"] + failures))
+
+
+if __name__ == "__main__":
+    main()
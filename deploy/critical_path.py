@@ -0,0 +1,239 @@
+"""Critical path and Gantt chart of a Pulumi deployment, from its engine events.
+
+Reads the engine events of an `up`, either written by deploy/driver.py
+(<project>.<stack>.up.events.jsonl) or by `pulumi up --event-log FILE`, and
+reconstructs when every resource step started and finished. The
+dependencies between resources come from the stack's exported deployment
+(`pulumi stack export`, or the .deployment.json the driver writes next to
+the events, which is picked up automatically).
+
+The engine stamps its events to the second only. The driver also times
+every step to the millisecond in the .resources.json next to the events;
+when that file is there (or given with --timings), its times are used.
+
+The critical path is the chain of steps that determined when the deployment
+finished: starting at the step that finished last, repeatedly move to the
+dependency it waited for, i.e. the one that finished last. Shortening any
+other step does not make the deployment faster.
+
+    python deploy/critical_path.py deploy-logs/ha-slurm-launcher.test.up.events.jsonl
+    python deploy/critical_path.py events.jsonl --deployment export.json --html gantt.html
+
+Without a deployment the dependencies are unknown, and each step is assumed
+to have waited for the step that finished last before it started.
+"""
+
+import argparse
+import html
+import json
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# The stack itself spans the whole deployment and providers are not steps worth timing
+IGNORED_TYPES = ("pulumi:pulumi:Stack", "pulumi:providers:")
+
+
+@dataclass
+class Step:
+    urn: str
+    type: str
+    op: str
+    start: float
+    end: Optional[float] = None
+    failed: bool = False
+    dependencies: List[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.urn.split("::")[-1]
+
+    @property
+    def seconds(self) -> float:
+        return (self.end or self.start) - self.start
+
+
+def load_events(path: Path) -> Dict[str, Step]:
+    """Resource steps from an engine event log, by URN."""
+    steps: Dict[str, Step] = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            timestamp = float(event.get("timestamp", 0))
+            if "resourcePreEvent" in event:
+                meta = event["resourcePreEvent"]["metadata"]
+                if meta["op"] in ("same", "read") or meta["type"].startswith(IGNORED_TYPES):
+                    continue
+                steps[meta["urn"]] = Step(meta["urn"], meta["type"], meta["op"], timestamp)
+            for key in ("resOutputsEvent", "resOpFailedEvent"):
+                if key in event:
+                    step = steps.get(event[key]["metadata"]["urn"])
+                    if step is not None:
+                        step.end = timestamp
+                        step.failed = key == "resOpFailedEvent"
+    # Steps still running when the log ends (e.g. a cancelled up) end with it
+    last = max((s.end or s.start for s in steps.values()), default=0)
+    for s in steps.values():
+        if s.end is None:
+            s.end = last
+    return steps
+
+
+def load_timings(path: Path, steps: Dict[str, Step]) -> None:
+    """Replace the start and end of `steps` with the precise times deploy/driver.py recorded."""
+    with open(path) as f:
+        resources = json.load(f).get("resources", [])
+    for resource in resources:
+        step = steps.get(resource["urn"])
+        if step is not None and resource.get("start") is not None:
+            step.start = resource["start"]
+            if resource.get("end") is not None:
+                step.end = resource["end"]
+
+
+def load_dependencies(path: Path, steps: Dict[str, Step]) -> None:
+    """Set the dependencies of `steps` from an exported deployment."""
+    with open(path) as f:
+        deployment = json.load(f)
+    # `pulumi stack export` wraps the deployment, the driver writes it bare
+    deployment = deployment.get("deployment", deployment)
+    for resource in deployment.get("resources", []):
+        step = steps.get(resource["urn"])
+        if step is not None:
+            step.dependencies = [d for d in resource.get("dependencies", []) if d in steps]
+
+
+def infer_dependencies(steps: Dict[str, Step]) -> None:
+    """Assume every step waited for the step that finished last before it started."""
+    by_end = sorted(steps.values(), key=lambda s: s.end)
+    for s in steps.values():
+        before = [o for o in by_end if o.end <= s.start and o is not s]
+        s.dependencies = [before[-1].urn] if before else []
+
+
+def critical_path(steps: Dict[str, Step]) -> List[Step]:
+    """Chain of steps that gated the end of the deployment, first step first."""
+    if not steps:
+        return []
+    current = max(steps.values(), key=lambda s: s.end)
+    chain = [current]
+    while True:
+        before = [steps[d] for d in current.dependencies if d in steps]
+        if not before:
+            return chain[::-1]
+        current = max(before, key=lambda s: s.end)
+        chain.append(current)
+
+
+# ------------------------------------------------------------------------------
+# Output
+# ------------------------------------------------------------------------------
+
+def print_critical_path(chain: List[Step], origin: float) -> None:
+    print("critical path (offset from deployment start, duration, wait for the previous step)")
+    previous_end = origin
+    for s in chain:
+        wait = s.start - previous_end
+        print(f"  {s.start - origin:>7.1f}s {s.seconds:>7.1f}s {wait:>7.1f}s  {s.op:<8} {s.type:<36} {s.name}")
+        previous_end = s.end
+    busy = sum(s.seconds for s in chain)
+    total = chain[-1].end - origin if chain else 0
+    print(f"\ntotal {total:.1f}s, {busy:.1f}s of it in critical steps, {total - busy:.1f}s waiting")
+
+
+def text_gantt(steps: List[Step], critical: set, origin: float, width: int) -> str:
+    end = max(s.end for s in steps)
+    scale = width / max(end - origin, 1)
+    label = max(len(s.name) for s in steps)
+    total = f"{end - origin:.0f}s"
+    lines = [f"{'':<{label}}  0s{total:>{width - 2}}"]
+    for s in steps:
+        left = int((s.start - origin) * scale)
+        length = max(1, int(s.seconds * scale))
+        mark = "!" if s.failed else "#" if s.urn in critical else "="
+        lines.append(f"{s.name:<{label}} |{' ' * left}{mark * length}{' ' * (width - left - length)}| {s.seconds:.1f}s")
+    lines.append("\n# critical path  = other steps  ! failed")
+    return "\n".join(lines)
+
+
+def html_gantt(steps: List[Step], critical: set, origin: float, title: str) -> str:
+    end = max(s.end for s in steps)
+    total = max(end - origin, 1)
+    rows = []
+    for s in steps:
+        left = 100 * (s.start - origin) / total
+        length = max(0.2, 100 * s.seconds / total)
+        cls = "failed" if s.failed else "critical" if s.urn in critical else ""
+        tip = html.escape(f"{s.type} {s.name}: {s.op}, +{s.start - origin:.1f}s for {s.seconds:.1f}s")
+        rows.append(
+            f'<div class="row"><div class="label">{html.escape(s.name)}</div>'
+            f'<div class="track"><div class="bar {cls}" style="left:{left:.2f}%;width:{length:.2f}%" '
+            f'title="{tip}"></div></div><div class="time">{s.seconds:.1f}s</div></div>'
+        )
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{ font: 12px sans-serif; margin: 1em; }}
+.row {{ display: flex; align-items: center; height: 16px; }}
+.label {{ width: 28em; overflow: hidden; white-space: nowrap; text-overflow: ellipsis; }}
+.track {{ position: relative; flex: 1; height: 12px; background: #f4f4f4; }}
+.bar {{ position: absolute; height: 100%; background: #8aa9d6; }}
+.bar.critical {{ background: #d9534f; }}
+.bar.failed {{ background: #333; }}
+.time {{ width: 5em; text-align: right; }}
+</style></head><body>
+<h1>{html.escape(title)}</h1>
+<p>{len(steps)} steps over {total:.0f}s; the critical path is shown in red.</p>
+{chr(10).join(rows)}
+</body></html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("events", type=Path, help="engine event log (JSON lines)")
+    parser.add_argument("--deployment", type=Path, help="exported deployment with the dependencies between resources")
+    parser.add_argument("--timings", type=Path, help="the driver's .resources.json with precise step times")
+    parser.add_argument("--html", type=Path, help="also write the Gantt chart as HTML to this file")
+    parser.add_argument("--width", type=int, default=80, help="width of the text chart's bars (default: 80)")
+    args = parser.parse_args()
+
+    steps = load_events(args.events)
+    if not steps:
+        sys.exit(f"no resource steps in {args.events}")
+
+    def beside_events(suffix: str) -> Optional[Path]:
+        if not args.events.name.endswith(".events.jsonl"):
+            return None
+        candidate = args.events.with_name(args.events.name.replace(".events.jsonl", suffix))
+        return candidate if candidate.exists() else None
+
+    timings = args.timings or beside_events(".resources.json")
+    if timings is not None:
+        load_timings(timings, steps)
+
+    deployment = args.deployment or beside_events(".deployment.json")
+    if deployment is not None:
+        load_dependencies(deployment, steps)
+    else:
+        print("no deployment given, inferring dependencies from the timings\n", file=sys.stderr)
+        infer_dependencies(steps)
+
+    origin = min(s.start for s in steps.values())
+    chain = critical_path(steps)
+    critical = {s.urn for s in chain}
+    ordered = sorted(steps.values(), key=lambda s: (s.start, s.end))
+
+    print(text_gantt(ordered, critical, origin, args.width))
+    print()
+    print_critical_path(chain, origin)
+    if args.html:
+        args.html.write_text(html_gantt(ordered, critical, origin, args.events.name))
+        print(f"\nGantt chart written to {args.html}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Run `preview`, `up` and `destroy` on one or more stacks with the Automation API.
+
+A stack is a Pulumi project directory plus a stack name. Its config is set
+in one call before the operation, the engine events are streamed to the
+terminal (prefixed with the stack) and every operation leaves in the log
+directory:
+
+  * <project>.<stack>.<op>.log             the engine's own output,
+  * <project>.<stack>.<op>.events.jsonl    the engine events, in the format
+                                           of `pulumi up --event-log`,
+  * <project>.<stack>.<op>.resources.json  start, end and duration of every
+                                           resource step.
+
+After an `up` the stack's deployment is exported next to them
+(<project>.<stack>.up.deployment.json), which holds the dependencies
+between resources.
+
+One stack, with config given on the command line (the current stack of the
+project unless --stack is given):
+
+    python deploy/driver.py up ha-slurm-launcher --stack test -c slurmComputeNodeServerNumber=4
+
+Several stacks, concurrently, from a file:
+
+    python deploy/driver.py preview --stacks stacks.yaml --parallel 2
+
+    # stacks.yaml
+    stacks:
+      - project: ha-slurm-launcher
+        stack: slurm-test
+        config:
+          slurmComputeNodeServerNumber: 4
+        secrets:
+          rsw_license: $RSW_LICENSE      # taken from the environment
+      - project: ha-local-launcher
+        stack: local-test
+        config:
+          pwbServerNumber: 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+from pulumi import automation as auto
+
+OPERATIONS = ["preview", "up", "destroy"]
+
+_print_lock = threading.Lock()
+
+
+@dataclass
+class StackSpec:
+    project: Path
+    stack: Optional[str] = None
+    config: Dict[str, str] = field(default_factory=dict)
+    secrets: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def label(self) -> str:
+        return f"{self.project.name}/{self.stack}"
+
+    @classmethod
+    def from_dict(cls, spec: Dict, base: Path) -> "StackSpec":
+        return cls(
+            project=(base / spec["project"]).resolve(),
+            stack=spec.get("stack"),
+            config={k: str(v) for k, v in (spec.get("config") or {}).items()},
+            secrets={k: os.path.expandvars(str(v)) for k, v in (spec.get("secrets") or {}).items()},
+        )
+
+
+def to_json(value):
+    """An Automation API event object as the JSON the engine wrote it in."""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {k: to_json(v) for k, v in value.items()}
+    if hasattr(value, "__dict__"):
+        return {
+            _camel(k): to_json(v) for k, v in vars(value).items()
+            if v is not None and not k.startswith("_")
+        }
+    return value
+
+
+def _camel(name: str) -> str:
+    head, *rest = name.split("_")
+    return head + "".join(part.title() for part in rest)
+
+
+# ------------------------------------------------------------------------------
+# Event recording
+# ------------------------------------------------------------------------------
+
+class EventRecorder:
+    """Streams engine events and times every resource step.
+
+    A step starts at its `resourcePreEvent` and ends at the matching
+    `resOutputsEvent` or `resOpFailedEvent`. Times are taken when the event
+    arrives, the engine's own timestamps only have a resolution of seconds.
+    """
+
+    def __init__(self, label: str, events_path: Path):
+        self.label = label
+        self.events = open(events_path, "w")
+        self.steps: Dict[str, Dict] = {}
+        self.summary: Dict[str, int] = {}
+
+    def say(self, message: str) -> None:
+        with _print_lock:
+            print(f"[{self.label}] {message}", flush=True)
+
+    def __call__(self, event: auto.EngineEvent) -> None:
+        now = time.time()
+        record = to_json(event)
+        self.events.write(json.dumps(record) + "\n")
+
+        if event.resource_pre_event:
+            meta = event.resource_pre_event.metadata
+            if meta.op == auto.OpType.SAME:
+                return
+            self.steps[meta.urn] = {
+                "urn": meta.urn, "type": meta.type, "op": meta.op.value,
+                "start": round(now, 3), "end": None, "seconds": None, "status": "running",
+            }
+            self.say(f"{meta.op.value:<8} {meta.type} {meta.urn.split('::')[-1]}")
+        elif event.res_outputs_event or event.res_op_failed_event:
+            failed = event.res_op_failed_event is not None
+            meta = (event.res_op_failed_event or event.res_outputs_event).metadata
+            step = self.steps.get(meta.urn)
+            if step is None:
+                return
+            step.update(end=round(now, 3), seconds=round(now - step["start"], 3),
+                        status="failed" if failed else "done")
+            self.say(f"{'FAILED' if failed else 'done':<8} {meta.type} {meta.urn.split('::')[-1]} "
+                     f"({step['seconds']:.0f}s)")
+        elif event.diagnostic_event and event.diagnostic_event.severity == "error":
+            self.say(f"error    {event.diagnostic_event.message.strip()}")
+        elif event.summary_event:
+            self.summary = {k.value if isinstance(k, Enum) else k: v
+                            for k, v in event.summary_event.resource_changes.items()}
+
+    def close(self) -> None:
+        self.events.close()
+
+    def slowest(self, n: int = 10) -> List[Dict]:
+        return sorted((s for s in self.steps.values() if s["seconds"] is not None),
+                      key=lambda s: -s["seconds"])[:n]
+
+
+# ------------------------------------------------------------------------------
+# Operations
+# ------------------------------------------------------------------------------
+
+def select_stack(spec: StackSpec) -> auto.Stack:
+    if spec.stack is None:
+        current = auto.LocalWorkspace(work_dir=str(spec.project)).stack()
+        if current is None:
+            raise ValueError(f"{spec.project.name} has no current stack, give one with --stack")
+        spec.stack = current.name
+    return auto.create_or_select_stack(stack_name=spec.stack, work_dir=str(spec.project))
+
+
+def run(spec: StackSpec, operation: str, log_dir: Path) -> Dict:
+    """Run `operation` on the stack of `spec`; the result summary."""
+    stack = select_stack(spec)
+    values = {k: auto.ConfigValue(value=v) for k, v in spec.config.items()}
+    values |= {k: auto.ConfigValue(value=v, secret=True) for k, v in spec.secrets.items()}
+    if values:
+        stack.set_all_config(values)
+
+    prefix = f"{spec.project.name}.{spec.stack}.{operation}"
+    path = lambda suffix: log_dir / (prefix + suffix)
+    recorder = EventRecorder(spec.label, path(".events.jsonl"))
+    start = time.time()
+    ok = True
+    try:
+        with open(path(".log"), "w") as log:
+            kwargs = dict(on_event=recorder, on_output=lambda line: log.write(line + "\n"), color="never")
+            if operation == "preview":
+                stack.preview(**kwargs)
+            elif operation == "up":
+                stack.up(**kwargs)
+            else:
+                stack.destroy(**kwargs)
+    except auto.CommandError as e:
+        ok = False
+        recorder.say(f"{operation} failed, see {path('.log')}: {str(e).splitlines()[0]}")
+    finally:
+        recorder.close()
+    seconds = time.time() - start
+
+    with open(path(".resources.json"), "w") as f:
+        json.dump({
+            "project": spec.project.name, "stack": spec.stack, "operation": operation,
+            "start": round(start, 3), "seconds": round(seconds, 3), "ok": ok,
+            "resources": list(recorder.steps.values()),
+        }, f, indent=2)
+    if operation == "up":
+        with open(path(".deployment.json"), "w") as f:
+            json.dump(stack.export_stack().deployment, f, indent=2)
+
+    return {
+        "label": spec.label, "ok": ok, "seconds": seconds,
+        "changes": recorder.summary, "slowest": recorder.slowest(5),
+    }
+
+
+def print_results(results: List[Dict]) -> None:
+    print()
+    for r in results:
+        changes = ", ".join(f"{op} {n}" for op, n in sorted(r["changes"].items())) or "-"
+        print(f"{r['label']:<36} {'ok' if r['ok'] else 'FAILED':<7} {r['seconds']:>6.0f}s  {changes}")
+        for s in r["slowest"]:
+            print(f"    {s['seconds']:>6.0f}s  {s['op']:<8} {s['urn'].split('::')[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("operation", choices=OPERATIONS)
+    parser.add_argument("project", nargs="?", type=Path, help="Pulumi project directory of a single stack")
+    parser.add_argument("--stack", help="stack of the single project (default: its current stack)")
+    parser.add_argument("-c", "--config", action="append", default=[], metavar="KEY=VALUE",
+                        help="config value of the single stack, may be repeated")
+    parser.add_argument("--secret", action="append", default=[], metavar="KEY=VALUE",
+                        help="secret config value of the single stack, may be repeated")
+    parser.add_argument("--stacks", type=Path, help="YAML file listing the stacks, see above")
+    parser.add_argument("--parallel", type=int, help="stacks to run at the same time (default: all)")
+    parser.add_argument("--log-dir", type=Path, default=Path("deploy-logs"),
+                        help="where to write the logs and timings (default: deploy-logs)")
+    args = parser.parse_args()
+
+    if args.stacks:
+        with open(args.stacks) as f:
+            specs = [StackSpec.from_dict(s, args.stacks.resolve().parent) for s in yaml.safe_load(f)["stacks"]]
+    elif args.project:
+        config = dict(kv.split("=", 1) for kv in args.config)
+        secrets = dict(kv.split("=", 1) for kv in args.secret)
+        specs = [StackSpec(args.project.resolve(), args.stack, config, secrets)]
+    else:
+        parser.error("give a project directory or --stacks")
+
+    args.log_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=args.parallel or len(specs)) as pool:
+        results = list(pool.map(lambda s: run(s, args.operation, args.log_dir), specs))
+    print_results(results)
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
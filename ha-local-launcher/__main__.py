@@ -1,16 +1,18 @@
 """An AWS Python Pulumi program"""
 
-import hashlib
 import os
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List
 
-import jinja2
 import pulumi
 from pulumi_aws import ec2, efs, rds, lb, directoryservice
 from pulumi_command import remote
 
+from ec2_catalog import catalog
+from bundle import env_echo_command, env_file, extract_command, make_bundle, shell_unescape
+from templating import template_cache
+
 # ------------------------------------------------------------------------------
 # Helper functions
 # ------------------------------------------------------------------------------
@@ -33,18 +35,14 @@ class ConfigValues:
         self.Domain = self.config.require("Domain")
         self.DomainPW = self.config.require("DomainPW")
         self.aws_region = self.config.require("region")
+        self.bundleServerSideFiles = self.config.get_bool("bundleServerSideFiles")
 
-def create_template(path: str) -> jinja2.Template:
-    with open(path, 'r') as f:
-        template = jinja2.Template(f.read())
-    return template
+def create_template(path: str):
+    return template_cache.template(path)
 
 
 def hash_file(path: str) -> pulumi.Output:
-    with open(path, mode="r") as f:
-        text = f.read()
-    hash_str = hashlib.sha224(bytes(text, encoding='utf-8')).hexdigest()
-    return pulumi.Output.concat(hash_str)
+    return pulumi.Output.concat(template_cache.digest(path))
 
 
 # ------------------------------------------------------------------------------
@@ -90,8 +88,11 @@ def main():
         "rs:project": "solutions",
     }
 
-
-
+    # --------------------------------------------------------------------------
+    # Check the instance type against the EC2 catalog
+    # --------------------------------------------------------------------------
+    # The AMI and every package installed on the nodes are x86_64
+    catalog.require(config.pwbInstanceType, arch="x86_64", setting="pwbInstanceType")
 
     # --------------------------------------------------------------------------
     # Set up keys.
@@ -273,37 +274,13 @@ def main():
             private_key=Path("key.pem").read_text()
         )
 
-        command_set_environment_variables = remote.Command(
-            f"server-{name}-set-env", 
-            create=pulumi.Output.concat(
-                'echo "export EFS_ID=',            file_system.id,           '" >> .env;\n',
-                'echo "export AD_PASSWD=',         ad_passwd,   '" >> .env;\n',
-                'echo "export AD_DOMAIN=',         ad_domain,   '" >> .env;\n',
-                'echo "export NAME=',              str(name+1),        '" >> .env;\n',
-                'echo "export RSW_LICENSE=',       os.getenv("RSW_LICENSE"), '" >> .env;',
-            ), 
-            connection=connection, 
-            opts=pulumi.ResourceOptions(depends_on=[server, db, file_system])
-        )
-
-        command_install_justfile = remote.Command(
-            f"server-{name}-install-justfile",
-            create="\n".join([
-                """curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
-                """echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
-            ]),
-            connection=connection, 
-            opts=pulumi.ResourceOptions(depends_on=[server])
-        )
-
-        command_copy_justfile = remote.CopyFile(
-            f"server-{name}-copy-justfile",  
-            local_path="server-side-files/justfile", 
-            remote_path='justfile', 
-            connection=connection, 
-            opts=pulumi.ResourceOptions(depends_on=[server]),
-            triggers=[hash_file("server-side-files/justfile")]
-        )
+        node_env = {
+            "EFS_ID": file_system.id,
+            "AD_PASSWD": ad_passwd,
+            "AD_DOMAIN": ad_domain,
+            "NAME": str(name+1),
+            "RSW_LICENSE": os.getenv("RSW_LICENSE"),
+        }
 
         # Copy the server side files
         @dataclass
@@ -367,9 +344,73 @@ def main():
             ),
         ]
 
-        command_copy_config_files = []
-        for f in server_side_files:
-            if True: 
+        # Packages and downloads need neither the directory nor the database:
+        # the server starts on them (`just prepare-rsw`) once it is reachable,
+        # with only the environment and the justfile in place. The config files
+        # rendered from AD and RDS wait for those by themselves and only
+        # `just finish-rsw` waits for the files.
+        if config.bundleServerSideFiles:
+            # One archive with the environment and the justfile, one with the
+            # config files, each unpacked in a single SSH session
+            scripts_bundle = pulumi.Output.all(env_file(node_env), template_cache.text("server-side-files/justfile")).apply(
+                lambda contents: make_bundle({".env": contents[0], "justfile": contents[1]})
+            )
+            config_files = {
+                f.file_out.removeprefix("~/"): f.template_render_command.apply(lambda text: shell_unescape(text) + "\n")
+                for f in server_side_files
+            }
+            config_bundle = pulumi.Output.all(*config_files.values()).apply(
+                lambda contents, names=list(config_files): make_bundle(dict(zip(names, contents)))
+            )
+            command_upload_bundle = remote.Command(
+                f"server-{name}-upload-bundle",
+                create=scripts_bundle.apply(lambda b: "\n".join([
+                    extract_command(b[0]) + ";",
+                    """[ -x ~/bin/just ] || curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
+                    """grep -qs 'HOME/bin' ~/.bashrc || echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
+                ])),
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server, file_system]),
+                triggers=[scripts_bundle.apply(lambda b: b[1])]
+            )
+            command_upload_config = remote.Command(
+                f"server-{name}-upload-config",
+                create=config_bundle.apply(lambda b: extract_command(b[0])),
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server]),
+                triggers=[config_bundle.apply(lambda b: b[1])]
+            )
+            early_files = [command_upload_bundle]
+            late_files = [command_upload_config]
+        else:
+            command_set_environment_variables = remote.Command(
+                f"server-{name}-set-env", 
+                create=env_echo_command(node_env), 
+                connection=connection, 
+                opts=pulumi.ResourceOptions(depends_on=[server, file_system])
+            )
+
+            command_install_justfile = remote.Command(
+                f"server-{name}-install-justfile",
+                create="\n".join([
+                    """curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
+                    """echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
+                ]),
+                connection=connection, 
+                opts=pulumi.ResourceOptions(depends_on=[server])
+            )
+
+            command_copy_justfile = remote.CopyFile(
+                f"server-{name}-copy-justfile",  
+                local_path="server-side-files/justfile", 
+                remote_path='justfile', 
+                connection=connection, 
+                opts=pulumi.ResourceOptions(depends_on=[server]),
+                triggers=[hash_file("server-side-files/justfile")]
+            )
+
+            command_copy_config_files = []
+            for f in server_side_files:
                 command_copy_config_files.append(
                     remote.Command(
                         f"copy {f.file_out} server {name}",
@@ -379,14 +420,22 @@ def main():
                         triggers=[hash_file(f.file_in)]
                     )
                 )
+            early_files = [command_set_environment_variables, command_install_justfile, command_copy_justfile]
+            late_files = command_copy_config_files
+
+        command_prepare_rsw = remote.Command(
+            f"server-{name}-prepare-rsw",
+            create="""export PATH="$PATH:$HOME/bin"; just prepare-rsw""",
+            connection=connection,
+            opts=pulumi.ResourceOptions(depends_on=early_files)
+        )
 
         command_build_rsw = remote.Command(
             f"server-{name}-build-rsw", 
             # create="alias just='/home/ubuntu/bin/just'; just build-rsw", 
-            create="""export PATH="$PATH:$HOME/bin"; just build-rsw""", 
+            create="""export PATH="$PATH:$HOME/bin"; just finish-rsw""", 
             connection=connection, 
-            opts=pulumi.ResourceOptions(depends_on=[command_set_environment_variables, command_install_justfile, command_copy_justfile] + command_copy_config_files)
+            opts=pulumi.ResourceOptions(depends_on=late_files + [command_prepare_rsw])
         )
 
-
 main()
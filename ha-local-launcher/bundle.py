@@ -0,0 +1,80 @@
+"""Ship all per-node files in one archive instead of one SSH command per file.
+
+The archive is deterministic (sorted entries, zeroed timestamps and owners),
+so its content - and with it the remote command - only changes when one of
+the files does. A manifest of per-file sha256 digests is packed alongside and
+its digest is used as the trigger for re-sending the bundle.
+"""
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import re
+import tarfile
+from itertools import chain
+from typing import Dict, Tuple
+
+import pulumi
+
+MANIFEST_NAME = ".bundle-manifest.json"
+
+# Files holding secrets are unpacked readable by the owner only.
+PRIVATE_FILES = {".env"}
+
+_DOUBLE_QUOTE_ESCAPE = re.compile(r'\\([$`"\\\n])')
+
+
+def shell_unescape(text: str) -> str:
+    """Undo the backslash escapes that `echo "..."` would have consumed.
+
+    The config templates are written to be pasted into a double-quoted shell
+    string (e.g. `\\$argv` in the expect scripts); this returns the exact text
+    such an echo would have written, minus the need for a shell to do it.
+    """
+    return _DOUBLE_QUOTE_ESCAPE.sub(lambda m: "" if m.group(1) == "\n" else m.group(1), text)
+
+
+def make_bundle(files: Dict[str, str]) -> Tuple[str, str]:
+    """Pack `files` (name -> content) into a base64 tar.gz; return it with the manifest digest."""
+    manifest = {name: hashlib.sha256(files[name].encode()).hexdigest() for name in sorted(files)}
+    manifest_text = json.dumps(manifest, indent=2, sort_keys=True) + "\n"
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+        with tarfile.open(fileobj=gz, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+            for name, content in sorted(files.items()) + [(MANIFEST_NAME, manifest_text)]:
+                data = content.encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o600 if name in PRIVATE_FILES else 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+    payload = base64.b64encode(buf.getvalue()).decode()
+    return payload, hashlib.sha256(manifest_text.encode()).hexdigest()
+
+
+def extract_command(payload: str) -> str:
+    """Shell command that unpacks a bundle made by `make_bundle` into the home directory."""
+    return f"echo '{payload}' | base64 -d | tar -xzmf - -C ~ --no-same-owner"
+
+
+# ------------------------------------------------------------------------------
+# .env helpers
+# ------------------------------------------------------------------------------
+
+def env_file(env: Dict[str, pulumi.Input[str]]) -> pulumi.Output:
+    """Content of the `.env` file sourced by the server-side justfile."""
+    return pulumi.Output.concat(*chain.from_iterable(
+        ("export ", key, "=", value, "\n") for key, value in env.items()
+    ))
+
+
+def env_echo_command(env: Dict[str, pulumi.Input[str]]) -> pulumi.Output:
+    """Shell commands that write the `.env` file one `echo` per variable."""
+    parts = []
+    for i, (key, value) in enumerate(env.items()):
+        escaped = pulumi.Output.from_input(value).apply(lambda v: v.replace('"', '\\"'))
+        parts += [f'echo "export {key}=', escaped, '" >' + (">" if i else "") + ' .env;\n']
+    return pulumi.Output.concat(*parts)
@@ -0,0 +1,79 @@
+"""Process-wide cache for the server-side config templates and their digests.
+
+Every node renders the same handful of Jinja files, so compiling and hashing
+them once per (path, mtime) instead of once per node keeps `pulumi preview`
+and `pulumi up` flat as the node count grows.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import jinja2
+
+
+class TemplateCache:
+    """Compiled templates and content digests keyed by path + mtime."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Tuple[int, jinja2.Template]] = {}
+        self._digests: Dict[str, Tuple[int, str]] = {}
+        self._texts: Dict[str, Tuple[int, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str) -> Tuple[str, int]:
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns
+
+    def _lookup(self, store: Dict, path: str, load):
+        key, mtime = self._key(path)
+        with self._lock:
+            cached = store.get(key)
+            if cached is not None and cached[0] == mtime:
+                self.hits += 1
+                return cached[1]
+        value = load(key)
+        with self._lock:
+            self.misses += 1
+            store[key] = (mtime, value)
+        return value
+
+    def template(self, path: str) -> jinja2.Template:
+        """Return the compiled Jinja template stored at `path`."""
+        def load(key):
+            return jinja2.Template(self.text(key))
+        return self._lookup(self._templates, path, load)
+
+    def text(self, path: str) -> str:
+        """Return the raw text stored at `path`."""
+        def load(key):
+            with open(key, mode="r") as f:
+                return f.read()
+        return self._lookup(self._texts, path, load)
+
+    def digest(self, path: str) -> str:
+        """Return the sha224 hex digest of the text stored at `path`."""
+        def load(key):
+            text = self.text(key)
+            return hashlib.sha224(bytes(text, encoding='utf-8')).hexdigest()
+        return self._lookup(self._digests, path, load)
+
+    def invalidate(self, path: Optional[str] = None):
+        """Drop the cached entries for `path`, or everything if no path is given."""
+        with self._lock:
+            if path is None:
+                self._templates.clear()
+                self._digests.clear()
+                self._texts.clear()
+            else:
+                key = os.path.abspath(path)
+                self._templates.pop(key, None)
+                self._digests.pop(key, None)
+                self._texts.pop(key, None)
+
+
+template_cache = TemplateCache()
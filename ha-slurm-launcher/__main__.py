@@ -1,18 +1,25 @@
 """An AWS Python Pulumi program"""
 
 import hashlib
-import os,json
+import json
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List
-from functools import reduce
-from itertools import chain
 
-import jinja2
 import pulumi
 from pulumi_aws import ec2, efs, rds, lb, directoryservice
 from pulumi_command import remote
 
+from ec2_catalog import catalog
+from launcher_profiles import profile_limits, resource_profiles
+from bundle import env_echo_command, env_file, extract_command, make_bundle, shell_unescape
+from templating import template_cache
+from slurm_config import SLURM_HOMES, power_save_section
+from topology import ClusterTopology, NodePool
+
+# Shared storage mounted on /efs by every node, see `mount-efs` in the justfile
+STORAGE_BACKENDS = ["efs", "nfs"]
+
 # ------------------------------------------------------------------------------
 # Helper functions
 # ------------------------------------------------------------------------------
@@ -33,6 +40,7 @@ class ConfigValues:
         self.slurmHeadNodeInstanceType = self.config.require("slurmHeadNodeInstanceType")
         self.slurmComputeNodeServerNumber = self.config.require("slurmComputeNodeServerNumber")
         self.slurmComputeNodeInstanceType = self.config.require("slurmComputeNodeInstanceType")
+        self.slurmComputeNodePools = self.config.get_object("slurmComputeNodePools")
         self.slurmAmi = self.config.require("slurmAmi")
         self.rsw_license = self.config.require("rsw_license")
         self.pwbVersion = self.config.require("pwbVersion")
@@ -43,18 +51,47 @@ class ConfigValues:
         self.DomainPW = self.config.require("DomainPW")
 
         self.aws_region = self.config.require("region")
-
-def create_template(path: str) -> jinja2.Template:
-    with open(path, 'r') as f:
-        template = jinja2.Template(f.read())
-    return template
+        self.bundleServerSideFiles = self.config.get_bool("bundleServerSideFiles")
+        self.slurmElasticCompute = self.config.get_bool("slurmElasticCompute")
+        self.slurmSuspendTime = self.config.get_int("slurmSuspendTime") or 600
+        self.slurmInstall = self.config.get("slurmInstall") or "local"
+        self.localScratch = self.config.get_bool("localScratch")
+        self.slurmWholeNodeGroups = self.config.get_object("slurmWholeNodeGroups") or []
+        self.scratchVolumeSize = self.config.get_int("scratchVolumeSize") or 0
+        self.rSiteLibrary = self.config.get_bool("rSiteLibrary")
+        self.sssdCacheTimeout = self.config.get_int("sssdCacheTimeout") or 14400
+        self.sssdWarmCache = self.config.get_bool("sssdWarmCache")
+        self.storageBackend = self.config.get("storageBackend") or "efs"
+        self.efsPerformanceMode = self.config.get("efsPerformanceMode") or "generalPurpose"
+        self.efsThroughputMode = self.config.get("efsThroughputMode") or "bursting"
+        self.efsProvisionedThroughput = self.config.get_int("efsProvisionedThroughput")
+        self.nfsServerInstanceType = self.config.get("nfsServerInstanceType") or "m6i.xlarge"
+        self.nfsVolumeSize = self.config.get_int("nfsVolumeSize") or 500
+        self.nfsThreads = self.config.get_int("nfsThreads") or 64
+
+@dataclass
+class serverSideFile:
+    file_in: str
+    file_out: str
+    template_render_command: pulumi.Output
+
+
+def create_template(path: str):
+    return template_cache.template(path)
 
 
 def hash_file(path: str) -> pulumi.Output:
-    with open(path, mode="r") as f:
-        text = f.read()
-    hash_str = hashlib.sha224(bytes(text, encoding='utf-8')).hexdigest()
-    return pulumi.Output.concat(hash_str)
+    return pulumi.Output.concat(template_cache.digest(path))
+
+
+def outputs_digest(*values: pulumi.Input) -> pulumi.Output:
+    """sha224 of `values`, a single trigger for a command that re-runs when any of them changes.
+
+    Pass properties of the commands that upload the files rather than the
+    rendered files themselves: these depend on every resource the files are
+    rendered from, which would make the command depend on all of them too.
+    """
+    return pulumi.Output.all(*values).apply(lambda v: hashlib.sha224(json.dumps(v, sort_keys=True).encode()).hexdigest())
 
 
 # ------------------------------------------------------------------------------
@@ -69,7 +106,8 @@ def make_server(
     vpc_group_ids: List[str],
     subnet_id: str,
     instance_type: str,
-    ami: str
+    ami: str,
+    data_volume_size: int = 0
 ):
     # Stand up a server.
     server = ec2.Instance(
@@ -80,7 +118,15 @@ def make_server(
         tags=tags,
         subnet_id=subnet_id,
         key_name=key_pair.key_name,
-        iam_instance_profile="WindowsJoinDomain"
+        iam_instance_profile="WindowsJoinDomain",
+        # Blank data volume for local scratch or the NFS exports, see
+        # server-side-files/scratch_setup.sh and nfs_server.sh
+        ebs_block_devices=[ec2.InstanceEbsBlockDeviceArgs(
+            device_name="/dev/sdf",
+            volume_size=data_volume_size,
+            volume_type="gp3",
+            delete_on_termination=True,
+        )] if data_volume_size else None,
     )
     
     # Export final pulumi variables.
@@ -103,9 +149,25 @@ def main():
     }
 
     # --------------------------------------------------------------------------
-    # Red EC2 instance details
+    # Check the instance types against the EC2 catalog
     # --------------------------------------------------------------------------
-    ec2_details=json.load(open("tools/ec2-list.json"))
+    node_pools = NodePool.from_config(
+        config.slurmComputeNodePools,
+        config.slurmComputeNodeInstanceType,
+        config.slurmComputeNodeServerNumber,
+    )
+    # The AMI and every package installed on the nodes are x86_64
+    catalog.require(config.slurmHeadNodeInstanceType, arch="x86_64", setting="slurmHeadNodeInstanceType")
+    catalog.require(config.pwbInstanceType, arch="x86_64", setting="pwbInstanceType")
+    for pool in node_pools:
+        catalog.require(pool.instance_type, arch="x86_64", setting=f"instanceType of node pool {pool.name}")
+    if config.slurmInstall not in SLURM_HOMES:
+        raise ValueError(f"slurmInstall {config.slurmInstall!r} is not one of {', '.join(SLURM_HOMES)}")
+    slurm_home = SLURM_HOMES[config.slurmInstall]
+    if config.storageBackend not in STORAGE_BACKENDS:
+        raise ValueError(f"storageBackend {config.storageBackend!r} is not one of {', '.join(STORAGE_BACKENDS)}")
+    if config.storageBackend == "nfs":
+        catalog.require(config.nfsServerInstanceType, arch="x86_64", setting="nfsServerInstanceType")
 
     # --------------------------------------------------------------------------
     # Set up keys.
@@ -185,8 +247,10 @@ def main():
     # --------------------------------------------------------------------------
     # Stand up the servers
     # --------------------------------------------------------------------------
-    n_servers=int(config.slurmHeadNodeServerNumber)+int(config.slurmComputeNodeServerNumber)+int(config.pwbServerNumber)
+    n_servers=int(config.slurmHeadNodeServerNumber)+sum(p.count for p in node_pools)+int(config.pwbServerNumber)
     pulumi.export(f'number_of_servers', n_servers)
+    # Compute and Workbench nodes without instance store get an EBS volume for /scratch
+    scratch_volume_size = config.scratchVolumeSize if config.localScratch else 0
     
     # -------------------------------------------------------------------------
     # Head Nodes
@@ -215,22 +279,33 @@ def main():
     # Compute Nodes
     # -------------------------------------------------------------------------
 
-    n_slurm_compute_nodes=int(config.slurmComputeNodeServerNumber)
-    slurm_compute_node=[0]*n_slurm_compute_nodes
+    n_slurm_compute_nodes=sum(p.count for p in node_pools)
+    slurm_compute_node=[]
+    # Node names within their pool: "1", "2", ... without configured pools
+    # (as before pools existed), "<pool>-1", "<pool>-2", ... with them
+    slurm_compute_node_ids=[]
+    compute_pools=[]
     pulumi.export(f'number_of_slurm_compute_nodes', n_slurm_compute_nodes)
 
 
-    for i in range(n_slurm_compute_nodes):
-        slurm_compute_node[i] = make_server(
-            "compute-node-"+str(i+1),
-            "slurm",
-            tags=tags | {"Name": "slurm-compute-node-"+str(i+1)},
-            key_pair=key_pair,
-            vpc_group_ids=[security_group.id],
-            instance_type=config.slurmHeadNodeInstanceType,
-            subnet_id=vpc_subnet.id,
-            ami=config.slurmAmi
-        )
+    for pool in node_pools:
+        pool_nodes=[]
+        for i in range(pool.count):
+            node_id = f"{pool.name}-{i+1}" if config.slurmComputeNodePools else str(i+1)
+            pool_nodes.append(make_server(
+                "compute-node-"+node_id,
+                "slurm",
+                tags=tags | {"Name": "slurm-compute-node-"+node_id},
+                key_pair=key_pair,
+                vpc_group_ids=[security_group.id],
+                instance_type=pool.instance_type,
+                subnet_id=vpc_subnet.id,
+                ami=config.slurmAmi,
+                data_volume_size=scratch_volume_size
+            ))
+            slurm_compute_node_ids.append(node_id)
+        slurm_compute_node += pool_nodes
+        compute_pools.append((pool, pool_nodes))
 
     # -------------------------------------------------------------------------
     # Posit Workbench Servers
@@ -250,7 +325,8 @@ def main():
             vpc_group_ids=[security_group.id],
             instance_type=config.pwbInstanceType,
             subnet_id=vpc_subnet.id,
-            ami=config.pwbAmi
+            ami=config.pwbAmi,
+            data_volume_size=scratch_volume_size
         )
 
     # --------------------------------------------------------------------------
@@ -280,34 +356,68 @@ def main():
 
 
     # --------------------------------------------------------------------------
-    # Create EFS.
+    # Create the shared storage: EFS, or an NFS server on a dedicated node.
     # --------------------------------------------------------------------------
-    # Create a new file system.
-    file_system = efs.FileSystem("slurm-efs",tags= tags | {"Name": "slurm-efs"})
-    pulumi.export("efs_id", file_system.id)
-
-    # Create a mount target. Assumes that the servers are on the same subnet id.
-    mount_target = efs.MountTarget(
-        f"mount-target-slurm-1",
-        file_system_id=file_system.id,
-        subnet_id=vpc_subnets.ids[0],
-        security_groups=[security_group.id]
-    )
-
-    mount_target = efs.MountTarget(
-        f"mount-target-slurm-2",
-        file_system_id=file_system.id,
-        subnet_id=vpc_subnets.ids[1],
-        security_groups=[security_group.id]
-    )
+    if config.storageBackend == "efs":
+        # Create a new file system.
+        file_system = efs.FileSystem("slurm-efs",
+            performance_mode=config.efsPerformanceMode,
+            throughput_mode=config.efsThroughputMode,
+            provisioned_throughput_in_mibps=config.efsProvisionedThroughput if config.efsThroughputMode == "provisioned" else None,
+            tags= tags | {"Name": "slurm-efs"}
+        )
+        pulumi.export("efs_id", file_system.id)
+
+        # Create a mount target. Assumes that the servers are on the same subnet id.
+        mount_targets = [
+            efs.MountTarget(
+                f"mount-target-slurm-{i + 1}",
+                file_system_id=file_system.id,
+                subnet_id=vpc_subnets.ids[i],
+                security_groups=[security_group.id]
+            )
+            for i in range(3)
+        ]
+        efs_id = file_system.id
+        storage_host = pulumi.Output.concat(file_system.id, ".efs.", config.aws_region, ".amazonaws.com")
+        # What the nodes wait for before mounting the storage
+        storage_ready = mount_targets
+    else:
+        nfs_server = make_server(
+            "nfs-server-1",
+            "storage",
+            tags=tags | {"Name": "storage-nfs-server-1"},
+            key_pair=key_pair,
+            vpc_group_ids=[security_group.id],
+            instance_type=config.nfsServerInstanceType,
+            subnet_id=vpc_subnet.id,
+            ami=config.slurmAmi,
+            data_volume_size=config.nfsVolumeSize
+        )
+        nfs_connection = remote.ConnectionArgs(
+            host=nfs_server.public_dns,
+            user="ubuntu",
+            private_key=Path("key.pem").read_text()
+        )
+        command_copy_nfs_server = remote.CopyFile(
+            "storage-nfs-server-1-copy-nfs-server",
+            local_path="server-side-files/nfs_server.sh",
+            remote_path="nfs_server.sh",
+            connection=nfs_connection,
+            opts=pulumi.ResourceOptions(depends_on=[nfs_server]),
+            triggers=[hash_file("server-side-files/nfs_server.sh")]
+        )
+        command_nfs_server = remote.Command(
+            "storage-nfs-server-1-setup",
+            create=pulumi.Output.concat("sudo bash nfs_server.sh ", vpc_subnet.cidr_block, f" {config.nfsThreads}"),
+            connection=nfs_connection,
+            opts=pulumi.ResourceOptions(depends_on=[command_copy_nfs_server]),
+            triggers=[hash_file("server-side-files/nfs_server.sh")]
+        )
+        efs_id = ""
+        storage_host = nfs_server.private_dns
+        storage_ready = [command_nfs_server]
 
-    mount_target = efs.MountTarget(
-        f"mount-target-slurm-3",
-        file_system_id=file_system.id,
-        subnet_id=vpc_subnets.ids[2],
-        security_groups=[security_group.id]
-    )
-    
 
 
     # --------------------------------------------------------------------------
@@ -403,6 +513,78 @@ def main():
     pulumi.export('ad_passwd', ad_passwd)
 
 
+    # --------------------------------------------------------------------------
+    # Cluster-wide settings shared by every node
+    # --------------------------------------------------------------------------
+    topology = ClusterTopology.build(
+        slurm_head_node,
+        compute_pools,
+        posit_workbench_server,
+        catalog,
+        elastic=bool(config.slurmElasticCompute),
+    )
+    power_save = power_save_section(config.slurmSuspendTime) if config.slurmElasticCompute else ""
+    tmp_fs = "/scratch/tmp" if config.localScratch else ""
+    # Workbench session sizes that fit the compute nodes
+    partitions = [pool.partition(catalog) for pool in node_pools]
+    session_profiles = resource_profiles(partitions)
+    session_limits = profile_limits(partitions, session_profiles, config.slurmWholeNodeGroups)
+
+    cluster_env = {
+        "EFS_ID": efs_id,
+        "STORAGE_BACKEND": config.storageBackend,
+        "SLURM_VERSION": config.slurmVersion,
+        "SLURM_INSTALL": config.slurmInstall,
+        "CIDR_RANGE": vpc_subnet.cidr_block,
+        "NFS_SERVER": storage_host,
+        "SLURM_SERVERS": topology.head_node,
+        "SLURM_COMPUTE_NODES": pulumi.Output.concat('"', topology.compute_nodes, '"'),
+        "WORKBENCH_NODES": pulumi.Output.concat('"', topology.workbench_nodes, '"'),
+        "AD_DOMAIN": config.Domain,
+        "AD_PASSWD": config.DomainPW,
+        "PWB_VERSION": config.pwbVersion,
+        "AWS_REGION": config.aws_region,
+        "SSSD_WARM_CACHE": "true" if config.sssdWarmCache else "false",
+    }
+    # .env content for the bundle, or the echo commands writing it
+    cluster_env_file = env_file(cluster_env) if config.bundleServerSideFiles else env_echo_command(cluster_env)
+
+    # Config files copied to every node
+    common_server_side_files=[
+        serverSideFile(
+            "server-side-files/config/krb5.conf",
+            "~/krb5.conf",
+            pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/krb5.conf").render(domain_name=ad_domain))
+        ),
+        serverSideFile(
+            "server-side-files/config/resolv.conf",
+            "~/resolv.conf",
+            pulumi.Output.all(ad_domain,ad.dns_ip_addresses,config.aws_region).apply(lambda x: create_template("server-side-files/config/resolv.conf").render(domain_name=x[0],dns1=x[1][0], dns2=x[1][1], aws_region=x[2]))
+        ),
+        serverSideFile(
+            "server-side-files/config/create-users.exp",
+            "~/create-users.exp",
+            pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/create-users.exp").render(domain_name=x[0],domain_passwd=x[1]))
+        ),
+        serverSideFile(
+            "server-side-files/config/create-group.exp",
+            "~/create-group.exp",
+            pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/create-group.exp").render(domain_name=x[0],domain_passwd=x[1]))
+        ),
+        serverSideFile(
+            "server-side-files/config/add-group-member.exp",
+            "~/add-group-member.exp",
+            pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/add-group-member.exp").render(domain_name=x[0],domain_passwd=x[1]))
+        ),
+        serverSideFile(
+            "server-side-files/config/sssd.conf",
+            "~/sssd.conf",
+            # Expired entries are refreshed in the background at 3/4 of their lifetime
+            pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/sssd.conf").render(domain_name=ad_domain, cache_timeout=config.sssdCacheTimeout, refresh_interval=config.sssdCacheTimeout * 3 // 4))
+        ),
+    ]
+
+
     # Install required software one each server
     # --------------------------------------------------------------------------
 
@@ -411,7 +593,7 @@ def main():
     command_build=[""]*totalinstances
 
     for name, server in zip(["slurm_head_node-" + str(n+1) for n in list(range(n_slurm_head_nodes))]+
-                                ["slurm_compute_node-" + str(n+1) for n in list(range(n_slurm_compute_nodes))]+
+                                ["slurm_compute_node-" + node_id for node_id in slurm_compute_node_ids]+
                                 ["posit_workbench_server-" + str(n+1) for n in list(range(n_posit_workbench_servers))], 
                                             slurm_head_node+slurm_compute_node+posit_workbench_server):
         connection = remote.ConnectionArgs(
@@ -420,105 +602,30 @@ def main():
             private_key=Path("key.pem").read_text()
         )
 
-        #remove domain name from private_dns
-        slurm_nodes=list(slurm_compute_node[n].private_dns.apply(lambda host: host.split(".")[0])  for n in range(n_slurm_compute_nodes))
-        slurm_nodes_out=pulumi.Output.all(slurm_nodes).apply(lambda l: f"{l}")
-
-        #remove domain name from private_dns
-        workbench_nodes=list(posit_workbench_server[n].private_dns.apply(lambda host: host.split(".")[0])  for n in range(n_posit_workbench_servers))
-        workbench_nodes_out=pulumi.Output.all(workbench_nodes).apply(lambda l: f"{l}")
-        
-        compute_cpus=pulumi.Output.all(str(ec2_details[config.slurmHeadNodeInstanceType]["vcpus"])).apply(lambda l: f"{l[0]}")
-        compute_mem=pulumi.Output.all(str(ec2_details[config.slurmHeadNodeInstanceType]["memory_in_mib"])).apply(lambda l: f"{l[0]}")
-
-        command_set_environment_variables = remote.Command(
-            f"{name}-set-env",
-            create=pulumi.Output.concat(
-                'echo "export EFS_ID=',            file_system.id,           '" > .env;\n',
-                'echo "export SLURM_VERSION=',            config.slurmVersion,           '" >> .env;\n',
-                'echo "export CIDR_RANGE=',            vpc_subnet.cidr_block,           '" >> .env;\n',
-		        'echo "export NFS_SERVER=',            slurm_head_node[0].private_dns.apply(lambda host: host.split(".")[0]),           '" >> .env;\n',
-                'echo "export SLURM_SERVERS=',            slurm_head_node[0].private_dns.apply(lambda host: host.split(".")[0]),           '" >> .env;\n',
-                'echo "export SLURM_COMPUTE_NODES=\\"',   slurm_nodes_out,           '\\"" >> .env;\n',
-                'echo "export SLURM_COMPUTE_NODES_CPU=',  compute_cpus,          '" >> .env;\n',                
-                'echo "export SLURM_COMPUTE_NODES_MEM=',   compute_mem,          '" >> .env;\n',
-                'echo "export WORKBENCH_NODES=\\"',   workbench_nodes_out,           '\\"" >> .env;\n',
-		        'echo "export AD_DOMAIN=', config.Domain, '" >> .env;\n',
-                'echo "export AD_PASSWD=', config.DomainPW, '" >> .env;\n',
-                'echo "export PWB_VERSION=', config.pwbVersion, '" >> .env;\n',
-            ),
-            connection=connection,
-            opts=pulumi.ResourceOptions(depends_on=[server, slurm_acct_db, workbench_db, file_system, ad])
-        )
-
-        command_install_justfile = remote.Command(
-            f"{name}-install-justfile",
-            create="\n".join([
-                """curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
-                """echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
-            ]),
-            connection=connection,
-            opts=pulumi.ResourceOptions(depends_on=[server])
-        )
-
-        command_copy_justfile = remote.CopyFile(
-            f"{name}-copy-justfile",
-            local_path="server-side-files/justfile",
-            remote_path='justfile',
-            connection=connection,
-            opts=pulumi.ResourceOptions(depends_on=[server]),
-            triggers=[hash_file("server-side-files/justfile")]
-        )
-
         # Copy the server side files
-        @dataclass
-        class serverSideFile:
-            file_in: str
-            file_out: str
-            template_render_command: pulumi.Output
-
-        server_side_files=[
-            serverSideFile(
-                "server-side-files/config/krb5.conf",
-                "~/krb5.conf",
-                pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/krb5.conf").render(domain_name=ad_domain))
-            ),
-            serverSideFile(
-                "server-side-files/config/resolv.conf",
-                "~/resolv.conf",
-                pulumi.Output.all(ad_domain,ad.dns_ip_addresses,config.aws_region).apply(lambda x: create_template("server-side-files/config/resolv.conf").render(domain_name=x[0],dns1=x[1][0], dns2=x[1][1], aws_region=x[2]))
-            ),
-            serverSideFile(
-                "server-side-files/config/create-users.exp",
-                "~/create-users.exp",
-                pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/create-users.exp").render(domain_name=x[0],domain_passwd=x[1]))
-            ),
-            serverSideFile(
-                "server-side-files/config/create-group.exp",
-                "~/create-group.exp",
-                pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/create-group.exp").render(domain_name=x[0],domain_passwd=x[1]))
-            ),
-            serverSideFile(
-                "server-side-files/config/add-group-member.exp",
-                "~/add-group-member.exp",
-                pulumi.Output.all(ad_domain,ad_passwd).apply(lambda x: create_template("server-side-files/config/add-group-member.exp").render(domain_name=x[0],domain_passwd=x[1]))
-            ),
+        server_side_files = list(common_server_side_files)
 
-        ]
-        
         if "slurm_head_node" in name: 
             server_side_files.append(
                 serverSideFile(
                     "server-side-files/config/slurm.conf",
                     "~/slurm.conf",
-                    pulumi.Output.all(slurm_head_node[0].private_dns.apply(lambda host: host.split(".")[0]),config.slurmComputeNodeServerNumber).apply(lambda x: create_template("server-side-files/config/slurm.conf").render(slurmctld_host=x[0],compute_nodes=x[1]))
+                    pulumi.Output.all(topology.head_node,topology.slurm_nodes).apply(lambda x: create_template("server-side-files/config/slurm.conf").render(slurmctld_host=x[0],compute_nodes=x[1],power_save=power_save,tmp_fs=tmp_fs))
                 )
             )
+            if config.slurmElasticCompute:
+                server_side_files.append(
+                    serverSideFile(
+                        "server-side-files/config/slurm-power.conf",
+                        "~/slurm-power.conf",
+                        pulumi.Output.all(config.aws_region,topology.compute_instances).apply(lambda x: create_template("server-side-files/config/slurm-power.conf").render(aws_region=x[0],compute_instances=x[1]))
+                    )
+                )
             server_side_files.append(
                 serverSideFile( 
                     "server-side-files/config/slurmdbd.conf",
                     "~/slurmdbd.conf",
-                    pulumi.Output.all(slurm_acct_db.address,slurm_acct_db.username,slurm_acct_db.password,slurm_acct_db.db_name,slurm_head_node[0].private_dns.apply(lambda host: host.split(".")[0])).apply(lambda x: create_template("server-side-files/config/slurmdbd.conf").render(slurmdb_host=x[0],slurmdb_user=x[1],slurmdb_pass=x[2],slurmdb_name=x[3],slurmdbd_host=x[4]))
+                    pulumi.Output.all(slurm_acct_db.address,slurm_acct_db.username,slurm_acct_db.password,slurm_acct_db.db_name,topology.head_node).apply(lambda x: create_template("server-side-files/config/slurmdbd.conf").render(slurmdb_host=x[0],slurmdb_user=x[1],slurmdb_pass=x[2],slurmdb_name=x[3],slurmdbd_host=x[4]))
                 ),
             )
 
@@ -555,7 +662,21 @@ def main():
                 serverSideFile(
                     "server-side-files/config/launcher.slurm.conf",
                     "~/launcher.slurm.conf",
-                    pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/launcher.slurm.conf").render())
+                    pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/launcher.slurm.conf").render(slurm_home=slurm_home))
+                ),
+            )
+            server_side_files.append(
+                serverSideFile(
+                    "server-side-files/config/launcher.slurm.resources.conf",
+                    "~/launcher.slurm.resources.conf",
+                    pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/launcher.slurm.resources.conf").render(profiles=session_profiles))
+                ),
+            )
+            server_side_files.append(
+                serverSideFile(
+                    "server-side-files/config/launcher.slurm.profiles.conf",
+                    "~/launcher.slurm.profiles.conf",
+                    pulumi.Output.all().apply(lambda x: create_template("server-side-files/config/launcher.slurm.profiles.conf").render(limits=session_limits))
                 ),
             )
             server_side_files.append(
@@ -567,9 +688,89 @@ def main():
             )
         
 
-        command_copy_config_files = []
-        for f in server_side_files:
-            if True:
+        # Scripts run on the node as they are
+        scripts = ["justfile", "provision.py"]
+        if "slurm_head_node" in name and config.slurmElasticCompute:
+            scripts.append("slurm_power.py")
+        if "slurm_head_node" not in name and config.localScratch:
+            scripts.append("scratch_setup.sh")
+        if "slurm_head_node" not in name and config.rSiteLibrary:
+            scripts.append("r-packages.txt")
+
+        # Packages, builds and downloads need neither the directory nor the
+        # databases: the node starts on them (`just do-it early`) once it is
+        # reachable, with only the environment and the scripts in place. The
+        # config files rendered from AD and RDS wait for those by themselves
+        # and only the late phase (`just do-it late`) waits for the files.
+        if config.bundleServerSideFiles:
+            # One archive with the environment and the scripts, one with the
+            # config files, each unpacked in a single SSH session
+            scripts_bundle = pulumi.Output.all(cluster_env_file, *[
+                template_cache.text(f"server-side-files/{script}") for script in scripts
+            ]).apply(lambda contents, names=[".env"] + scripts: make_bundle(dict(zip(names, contents))))
+            config_files = {
+                f.file_out.removeprefix("~/"): f.template_render_command.apply(lambda text: shell_unescape(text) + "\n")
+                for f in server_side_files
+            }
+            config_bundle = pulumi.Output.all(*config_files.values()).apply(
+                lambda contents, names=list(config_files): make_bundle(dict(zip(names, contents)))
+            )
+            command_upload_bundle = remote.Command(
+                f"{name}-upload-bundle",
+                create=scripts_bundle.apply(lambda b: "\n".join([
+                    extract_command(b[0]) + ";",
+                    """[ -x ~/bin/just ] || curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
+                    """grep -qs 'HOME/bin' ~/.bashrc || echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
+                ])),
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server]),
+                triggers=[scripts_bundle.apply(lambda b: b[1])]
+            )
+            command_upload_config = remote.Command(
+                f"{name}-upload-config",
+                create=config_bundle.apply(lambda b: extract_command(b[0])),
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server]),
+                triggers=[config_bundle.apply(lambda b: b[1])]
+            )
+            early_files = [command_upload_bundle]
+            late_files = [command_upload_config]
+            early_manifest = outputs_digest(command_upload_bundle.triggers)
+            late_manifest = outputs_digest(command_upload_config.triggers)
+        else:
+            command_set_environment_variables = remote.Command(
+                f"{name}-set-env",
+                create=cluster_env_file,
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server])
+            )
+
+            command_install_justfile = remote.Command(
+                f"{name}-install-justfile",
+                create="\n".join([
+                    """curl --proto '=https' --tlsv1.2 -sSf https://just.systems/install.sh | bash -s -- --to ~/bin;""",
+                    """echo 'export PATH="$PATH:$HOME/bin"' >> ~/.bashrc;"""
+                ]),
+                connection=connection,
+                opts=pulumi.ResourceOptions(depends_on=[server])
+            )
+
+            command_copy_scripts = []
+            for script in scripts:
+                command_copy_scripts.append(
+                    remote.CopyFile(
+                        # justfile -> copy-justfile, provision.py -> copy-provision
+                        f"{name}-copy-{script.split('.')[0].replace('_', '-')}",
+                        local_path=f"server-side-files/{script}",
+                        remote_path=script,
+                        connection=connection,
+                        opts=pulumi.ResourceOptions(depends_on=[server]),
+                        triggers=[hash_file(f"server-side-files/{script}")]
+                    )
+                )
+
+            command_copy_config_files = []
+            for f in server_side_files:
                 command_copy_config_files.append(
                     remote.Command(
                         f"copy {f.file_out} server {name}",
@@ -579,23 +780,38 @@ def main():
                         triggers=[hash_file(f.file_in)]
                     )
                 )
+            early_files = [command_set_environment_variables, command_install_justfile] + command_copy_scripts
+            late_files = command_copy_config_files
+            early_manifest = outputs_digest(
+                command_set_environment_variables.create, *[c.triggers for c in command_copy_scripts]
+            )
+            late_manifest = outputs_digest(*[c.create for c in command_copy_config_files])
+
+        # provision.py keeps a stamp per step, so re-running the phases when
+        # the files change only runs the steps whose inputs changed
+        command_prepare = remote.Command(
+            f"{name}-prepare",
+            create="""export PATH="$PATH:$HOME/bin"; just do-it early""",
+            connection=connection,
+            # The artifact and download caches live on the shared storage
+            opts=pulumi.ResourceOptions(depends_on=early_files + storage_ready),
+            triggers=[early_manifest]
+        )
 
         if "head_node" not in name:
-            opts=pulumi.ResourceOptions(depends_on=[command_set_environment_variables, command_install_justfile, command_copy_justfile,  command_build[0]] + command_copy_config_files)
+            opts=pulumi.ResourceOptions(depends_on=late_files + [command_prepare, command_build[0]])
         else:
-            opts=pulumi.ResourceOptions(depends_on=[command_set_environment_variables, command_install_justfile, command_copy_justfile] + command_copy_config_files)
+            opts=pulumi.ResourceOptions(depends_on=late_files + [command_prepare])
 
         command_build[ctr] = remote.Command(
             f"{name}-do-it",
             # create="alias just='/home/ubuntu/bin/just'; just do-it; just integrate-ad",
-            create="""export PATH="$PATH:$HOME/bin"; just do-it; just integrate-ad""",
+            create="""export PATH="$PATH:$HOME/bin"; just do-it late; just integrate-ad""",
             connection=connection,
-            opts=opts
+            opts=opts,
+            triggers=[early_manifest, late_manifest]
         )
         ctr=ctr+1
 
-def new_func():
-    return 0
-
 
 main()
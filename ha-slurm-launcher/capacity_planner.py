@@ -0,0 +1,351 @@
+"""Size the Slurm compute pools and Workbench servers from a workload profile.
+
+A workload profile gives the number of concurrent users, the ratio between
+peak and average use, and the kinds of session users run with the CPUs and
+memory each one requests from Slurm:
+
+    concurrentUsers: 40        # users with a running session, on average
+    peakToAverage: 1.5         # size for 40 * 1.5 = 60 users
+    sessionsPerWorkbench: 100  # optional, sessions one Workbench server proxies
+    sessions:
+      - name: interactive
+        cpus: 1
+        memory: 4096           # MiB
+        perUser: 1             # sessions of this kind per user
+      - name: batch
+        cpus: 4
+        memory: 16384
+        perUser: 0.25
+
+Session kind names name the node pools of per-kind plans, so like pool
+names they may only contain letters, digits and underscores.
+
+Every x86_64 instance type of the EC2 catalog (see ec2_catalog.py) is tried,
+as one pool for all sessions and as one pool per session kind. Sessions are
+packed onto nodes first fit decreasing, against the CPUs and `RealMemory`
+Slurm sees on the node, i.e. after the REAL_MEMORY_PERCENT derating of
+slurm_config.py. The plans are ranked by node count or, given hourly prices,
+by cost.
+
+The ranking is printed to stderr and the Pulumi config of the best plan to
+stdout, so it can be applied right away:
+
+    python capacity_planner.py workload.yaml | sh
+    python capacity_planner.py workload.yaml --objective cost --prices prices.json
+    python capacity_planner.py --users 40 --cpus 1 --memory 4096 --format yaml
+"""
+
+import argparse
+import json
+import math
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+from ec2_catalog import InstanceType, catalog
+from slurm_config import POOL_NAME, REAL_MEMORY_PERCENT
+
+PROJECT = "slurm"
+
+# Workbench runs in HA mode, with at least two servers behind the load balancer
+MIN_WORKBENCH_SERVERS = 2
+
+
+@dataclass(frozen=True)
+class SessionKind:
+    """Sessions of one size, as requested from Slurm."""
+    name: str
+    cpus: int
+    memory_mib: int
+    count: int
+
+
+@dataclass
+class Workload:
+    concurrent_users: int
+    peak_to_average: float
+    kinds: List[SessionKind]
+    sessions_per_workbench: int = 100
+
+    @classmethod
+    def from_profile(cls, profile: Dict) -> "Workload":
+        """Workload of a profile as described in the module docstring."""
+        users = int(profile["concurrentUsers"])
+        peak = float(profile.get("peakToAverage", 1))
+        if users < 1 or peak < 1:
+            raise ValueError("concurrentUsers must be at least 1 and peakToAverage at least 1")
+        kinds = []
+        for s in profile["sessions"]:
+            kind = SessionKind(
+                name=s["name"],
+                cpus=int(s["cpus"]),
+                memory_mib=int(s["memory"]),
+                count=math.ceil(users * peak * float(s.get("perUser", 1))),
+            )
+            if not POOL_NAME.match(kind.name):
+                raise ValueError(f"session kind name {kind.name!r} may only contain letters, digits and underscores")
+            if any(k.name == kind.name for k in kinds):
+                raise ValueError(f"session kind {kind.name!r} is defined more than once")
+            if kind.cpus < 1 or kind.memory_mib < 1:
+                raise ValueError(f"session kind {kind.name!r} must request at least 1 CPU and 1 MiB")
+            kinds.append(kind)
+        if not kinds:
+            raise ValueError("the workload profile has no sessions")
+        return cls(users, peak, kinds, int(profile.get("sessionsPerWorkbench", 100)))
+
+    @property
+    def sessions(self) -> int:
+        return sum(k.count for k in self.kinds)
+
+    def workbench_servers(self) -> int:
+        return max(MIN_WORKBENCH_SERVERS, math.ceil(self.sessions / self.sessions_per_workbench))
+
+
+def slurm_memory(instance: InstanceType) -> int:
+    """`RealMemory` of a node of `instance`, as written to slurm.conf."""
+    return instance.memory_in_mib * REAL_MEMORY_PERCENT // 100
+
+
+def nodes_needed(kinds: List[SessionKind], instance: InstanceType) -> Optional[int]:
+    """Nodes of `instance` that hold all sessions of `kinds`, None if one doesn't fit at all.
+
+    Nodes are filled one at a time, largest sessions first, with as many
+    sessions of each kind as still fit.
+    """
+    cpus, memory = instance.vcpus, slurm_memory(instance)
+    if any(k.cpus > cpus or k.memory_mib > memory for k in kinds):
+        return None
+    order = sorted(kinds, key=lambda k: max(k.cpus / cpus, k.memory_mib / memory), reverse=True)
+    remaining = {k: k.count for k in order}
+    nodes = 0
+    while any(remaining.values()):
+        free_cpus, free_memory = cpus, memory
+        for k in order:
+            n = min(remaining[k], free_cpus // k.cpus, free_memory // k.memory_mib)
+            remaining[k] -= n
+            free_cpus -= n * k.cpus
+            free_memory -= n * k.memory_mib
+        nodes += 1
+    return nodes
+
+
+@dataclass
+class PoolPlan:
+    name: str
+    instance: InstanceType
+    count: int
+    kinds: List[SessionKind]
+
+
+@dataclass
+class Plan:
+    pools: List[PoolPlan]
+    prices: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def nodes(self) -> int:
+        return sum(p.count for p in self.pools)
+
+    @property
+    def vcpus(self) -> int:
+        return sum(p.count * p.instance.vcpus for p in self.pools)
+
+    @property
+    def memory_mib(self) -> int:
+        return sum(p.count * p.instance.memory_in_mib for p in self.pools)
+
+    @property
+    def cost(self) -> Optional[float]:
+        """Hourly cost of the compute nodes, None without prices."""
+        if any(p.instance.name not in self.prices for p in self.pools):
+            return None
+        return sum(p.count * self.prices[p.instance.name] for p in self.pools)
+
+    def utilization(self) -> float:
+        """Share of the pools' CPUs and Slurm memory the sessions use, whichever is higher."""
+        used_cpus = sum(k.cpus * k.count for p in self.pools for k in p.kinds)
+        used_memory = sum(k.memory_mib * k.count for p in self.pools for k in p.kinds)
+        total_memory = sum(p.count * slurm_memory(p.instance) for p in self.pools)
+        return max(used_cpus / self.vcpus, used_memory / total_memory)
+
+
+def best_pool(
+    name: str,
+    kinds: List[SessionKind],
+    candidates: List[InstanceType],
+    min_nodes: int,
+    prices: Dict[str, float],
+    rank,
+) -> Optional[PoolPlan]:
+    """Pool of the instance type that holds `kinds` best according to `rank`."""
+    pools = []
+    for instance in candidates:
+        n = nodes_needed(kinds, instance)
+        if n is not None:
+            pools.append(PoolPlan(name, instance, max(n, min_nodes), kinds))
+    return min(pools, key=lambda p: rank(Plan([p], prices)), default=None)
+
+
+def plan(
+    workload: Workload,
+    candidates: List[InstanceType],
+    objective: str = "nodes",
+    prices: Optional[Dict[str, float]] = None,
+    min_nodes: int = 1,
+) -> List[Plan]:
+    """Plans for `workload`, best first.
+
+    With objective "nodes" the fewest nodes win, then the fewest vCPUs and
+    memory; with "cost" the lowest hourly cost wins, then the fewest nodes.
+    """
+    prices = prices or {}
+    if objective == "cost":
+        candidates = [c for c in candidates if c.name in prices]
+        rank = lambda p: (p.cost, p.nodes, p.vcpus, p.memory_mib)
+    else:
+        rank = lambda p: (p.nodes, p.vcpus, p.memory_mib, p.cost or 0)
+
+    plans = []
+    for instance in candidates:
+        n = nodes_needed(workload.kinds, instance)
+        if n is not None:
+            plans.append(Plan([PoolPlan("all", instance, max(n, min_nodes), workload.kinds)], prices))
+
+    # One pool per session kind, each of the instance type that suits it best
+    if len(workload.kinds) > 1:
+        pools = [
+            best_pool(k.name, [k], candidates, min_nodes, prices, rank)
+            for k in workload.kinds
+        ]
+        if all(pools):
+            plans.append(Plan(pools, prices))
+
+    return sorted(plans, key=rank)
+
+
+# ------------------------------------------------------------------------------
+# Output
+# ------------------------------------------------------------------------------
+
+def config_values(p: Plan, workload: Workload) -> Dict[str, object]:
+    """Pulumi config of plan `p`, with `--path` style keys for the pools."""
+    values: Dict[str, object] = {}
+    if len(p.pools) == 1:
+        values["slurmComputeNodeInstanceType"] = p.pools[0].instance.name
+        values["slurmComputeNodeServerNumber"] = p.pools[0].count
+    else:
+        for i, pool in enumerate(p.pools):
+            values[f"slurmComputeNodePools[{i}].name"] = pool.name
+            values[f"slurmComputeNodePools[{i}].instanceType"] = pool.instance.name
+            values[f"slurmComputeNodePools[{i}].count"] = pool.count
+    values["pwbServerNumber"] = workload.workbench_servers()
+    return values
+
+
+def shell_config(p: Plan, workload: Workload) -> str:
+    lines = []
+    if len(p.pools) == 1:
+        lines.append("# slurmComputeNodePools overrides these two, remove it if it is set")
+    for key, value in config_values(p, workload).items():
+        path = " --path" if "[" in key else ""
+        lines.append(f"pulumi config set{path} '{key}' '{value}'")
+    return "\n".join(lines)
+
+
+def yaml_config(p: Plan, workload: Workload) -> str:
+    """`config:` section for Pulumi.<stack>.yaml."""
+    config: Dict[str, object] = {}
+    for key, value in config_values(p, workload).items():
+        if not key.startswith("slurmComputeNodePools"):
+            config[f"{PROJECT}:{key}"] = value
+    if len(p.pools) > 1:
+        config[f"{PROJECT}:slurmComputeNodePools"] = [
+            {"name": pool.name, "instanceType": pool.instance.name, "count": pool.count}
+            for pool in p.pools
+        ]
+    return yaml.safe_dump({"config": config}, sort_keys=False)
+
+
+def print_plans(plans: List[Plan], workload: Workload, top: int) -> None:
+    out = sys.stderr
+    print(
+        f"{workload.sessions} sessions for {workload.concurrent_users} users at "
+        f"{workload.peak_to_average:g}x peak, nodes sized with RealMemory at {REAL_MEMORY_PERCENT}%",
+        file=out,
+    )
+    for k in workload.kinds:
+        print(f"  {k.name:<16} {k.count:>5} x {k.cpus} CPUs, {k.memory_mib} MiB", file=out)
+    print(f"\n{'pools':<44} {'nodes':>5} {'vcpus':>6} {'used':>5} {'$/h':>8}", file=out)
+    for p in plans[:top]:
+        pools = ", ".join(f"{pool.name}: {pool.count} x {pool.instance.name}" for pool in p.pools)
+        cost = f"{p.cost:>8.2f}" if p.cost is not None else f"{'-':>8}"
+        print(f"{pools:<44} {p.nodes:>5} {p.vcpus:>6} {p.utilization():>5.0%} {cost}", file=out)
+    print(f"\nWorkbench servers: {workload.workbench_servers()} "
+          f"({workload.sessions_per_workbench} sessions each)\n", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("profile", nargs="?", type=Path, help="workload profile (YAML or JSON)")
+    single = parser.add_argument_group("single session kind, instead of a profile")
+    single.add_argument("--users", type=int, help="concurrent users")
+    single.add_argument("--cpus", type=int, default=1, help="CPUs per session (default: 1)")
+    single.add_argument("--memory", type=int, default=2048, help="MiB per session (default: 2048)")
+    single.add_argument("--peak-ratio", type=float, default=1.0, help="peak to average ratio (default: 1)")
+    parser.add_argument("--objective", choices=["nodes", "cost"], default="nodes")
+    parser.add_argument("--prices", type=Path, help="JSON object of hourly price per instance type")
+    parser.add_argument("--families", help="comma separated instance families to choose from, e.g. c6i,m6i,r6i")
+    parser.add_argument("--max-vcpus", type=int, help="largest instance size to consider")
+    parser.add_argument("--min-nodes", type=int, default=1, help="smallest number of nodes per pool (default: 1)")
+    parser.add_argument("--top", type=int, default=10, help="plans to list (default: 10)")
+    parser.add_argument("--format", choices=["shell", "yaml"], default="shell",
+                        help="`pulumi config set` commands or a Pulumi.<stack>.yaml config section")
+    args = parser.parse_args()
+
+    if args.profile:
+        with open(args.profile) as f:
+            profile = yaml.safe_load(f)
+    elif args.users:
+        profile = {
+            "concurrentUsers": args.users,
+            "peakToAverage": args.peak_ratio,
+            "sessions": [{"name": "session", "cpus": args.cpus, "memory": args.memory}],
+        }
+    else:
+        parser.error("give a workload profile or --users")
+    try:
+        workload = Workload.from_profile(profile)
+    except (KeyError, ValueError) as e:
+        sys.exit(f"invalid workload profile: {e}")
+
+    prices = {}
+    if args.prices:
+        with open(args.prices) as f:
+            prices = {k: float(v) for k, v in json.load(f).items()}
+    elif args.objective == "cost":
+        parser.error("--objective cost needs --prices")
+
+    # The AMI and every package installed on the nodes are x86_64
+    # Bare metal sizes have the same vCPUs and memory as the largest virtual ones
+    candidates = [c for c in catalog.find(arch="x86_64") if ".metal" not in c.name]
+    if args.families:
+        families = set(args.families.split(","))
+        candidates = [c for c in candidates if c.family in families]
+    if args.max_vcpus:
+        candidates = [c for c in candidates if c.vcpus <= args.max_vcpus]
+
+    plans = plan(workload, candidates, args.objective, prices, args.min_nodes)
+    if not plans:
+        sys.exit("no instance type fits the largest session")
+    print_plans(plans, workload, args.top)
+    if args.format == "shell":
+        print(shell_config(plans[0], workload))
+    else:
+        print(yaml_config(plans[0], workload), end="")
+
+
+if __name__ == "__main__":
+    main()
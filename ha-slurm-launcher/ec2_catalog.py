@@ -0,0 +1,186 @@
+"""EC2 instance type catalog: vCPUs, memory, architecture and family per type.
+
+The catalog is a compact, precomputed index in `tools/ec2-catalog.json`,
+loaded on first use. Refresh it from a saved `describe-instance-types` dump
+(works offline) or straight from the EC2 API:
+
+    python ec2_catalog.py refresh --from describe-instance-types.json
+    python ec2_catalog.py refresh
+    python ec2_catalog.py find --min-vcpus 8 --min-memory 65536 --arch x86_64
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+CATALOG_PATH = Path(__file__).resolve().parent / "tools" / "ec2-catalog.json"
+
+# Order of the values stored per instance type in the index
+COLUMNS = ["vcpus", "memory_in_mib", "arch", "family"]
+
+
+@dataclass(frozen=True)
+class InstanceType:
+    name: str
+    vcpus: int
+    memory_in_mib: int
+    arch: str
+    family: str
+
+
+class Ec2Catalog:
+    """Instance types by name, read from the index file on first access."""
+
+    def __init__(self, path: Path = CATALOG_PATH):
+        self.path = Path(path)
+        self._types: Optional[Dict[str, InstanceType]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def types(self) -> Dict[str, InstanceType]:
+        if self._types is None:
+            with self._lock:
+                if self._types is None:
+                    with open(self.path) as f:
+                        index = json.load(f)
+                    self._types = {
+                        name: InstanceType(name, *values)
+                        for name, values in index["types"].items()
+                    }
+        return self._types
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.types
+
+    def __getitem__(self, name: str) -> InstanceType:
+        return self.types[name]
+
+    def require(self, name: str, arch: Optional[str] = None, setting: str = "instance type") -> InstanceType:
+        """`name` from the catalog, or a ValueError saying what is wrong with `setting`."""
+        if name not in self.types:
+            raise ValueError(
+                f"{setting} {name!r} is not a known EC2 instance type "
+                f"(see {self.path.name}, refresh it with `python ec2_catalog.py refresh`)"
+            )
+        instance = self.types[name]
+        if arch is not None and instance.arch != arch:
+            raise ValueError(f"{setting} {name!r} is {instance.arch}, but the nodes need {arch}")
+        return instance
+
+    def find(
+        self,
+        min_vcpus: int = 0,
+        min_memory_in_mib: int = 0,
+        arch: Optional[str] = None,
+        family: Optional[str] = None,
+    ) -> List[InstanceType]:
+        """Instance types with at least the given size, smallest first."""
+        return sorted(
+            (
+                t for t in self.types.values()
+                if t.vcpus >= min_vcpus
+                and t.memory_in_mib >= min_memory_in_mib
+                and (arch is None or t.arch == arch)
+                and (family is None or t.family == family)
+            ),
+            key=lambda t: (t.vcpus, t.memory_in_mib, t.name),
+        )
+
+
+catalog = Ec2Catalog()
+
+
+# ------------------------------------------------------------------------------
+# Refresh
+# ------------------------------------------------------------------------------
+
+def primary_arch(architectures: List[str]) -> str:
+    """The architecture to catalog a type under: x86_64 for types that also list i386."""
+    return "x86_64" if "x86_64" in architectures else architectures[0]
+
+
+def index_from_dump(dump: Dict) -> Dict[str, list]:
+    """Index entries from the output of `aws ec2 describe-instance-types`."""
+    types = {}
+    for t in dump["InstanceTypes"]:
+        name = t["InstanceType"]
+        types[name] = [
+            t["VCpuInfo"]["DefaultVCpus"],
+            t["MemoryInfo"]["SizeInMiB"],
+            primary_arch(t["ProcessorInfo"]["SupportedArchitectures"]),
+            name.split(".")[0],
+        ]
+    return dict(sorted(types.items()))
+
+
+def describe_instance_types() -> Dict:
+    """Current generation instance types from the EC2 API (needs the AWS CLI and credentials)."""
+    out = subprocess.check_output([
+        "aws", "ec2", "describe-instance-types",
+        "--filters", "Name=current-generation,Values=true", "--output", "json",
+    ])
+    return json.loads(out)
+
+
+def write_index(types: Dict[str, list], path: Path, source: str) -> None:
+    index = {
+        "generated": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "source": source,
+        "columns": COLUMNS,
+        "types": types,
+    }
+    with open(path, "w") as f:
+        # One instance type per line keeps the file small and diffs readable
+        f.write("{\n")
+        for key in ["generated", "source", "columns"]:
+            f.write(f'  "{key}": {json.dumps(index[key])},\n')
+        f.write('  "types": {\n')
+        f.write(",\n".join(f"    {json.dumps(n)}: {json.dumps(v)}" for n, v in types.items()))
+        f.write("\n  }\n}\n")
+
+
+def print_types(types: Iterable[InstanceType]) -> None:
+    print(f"{'type':<20} {'vcpus':>6} {'memory MiB':>11}  {'arch':<8} family")
+    for t in types:
+        print(f"{t.name:<20} {t.vcpus:>6} {t.memory_in_mib:>11}  {t.arch:<8} {t.family}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    refresh = sub.add_parser("refresh", help="rebuild the index")
+    refresh.add_argument("--from", dest="dump", type=Path,
+                         help="saved `aws ec2 describe-instance-types` output to read instead of calling the API")
+    refresh.add_argument("--output", type=Path, default=CATALOG_PATH, help=f"default: {CATALOG_PATH.name}")
+
+    find = sub.add_parser("find", help="list instance types of at least a given size")
+    find.add_argument("--min-vcpus", type=int, default=0)
+    find.add_argument("--min-memory", type=int, default=0, help="MiB")
+    find.add_argument("--arch")
+    find.add_argument("--family")
+
+    args = parser.parse_args()
+    if args.command == "refresh":
+        if args.dump:
+            with open(args.dump) as f:
+                dump, source = json.load(f), args.dump.name
+        else:
+            dump, source = describe_instance_types(), "aws ec2 describe-instance-types"
+        types = index_from_dump(dump)
+        if not types:
+            sys.exit("no instance types found, keeping the current catalog")
+        write_index(types, args.output, source)
+        print(f"{len(types)} instance types written to {args.output}")
+    else:
+        print_types(catalog.find(args.min_vcpus, args.min_memory, args.arch, args.family))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Workbench resource profiles for Slurm sessions, generated from the compute partitions.
+
+Rendered into launcher.slurm.resources.conf (the profiles users pick from)
+and launcher.slurm.profiles.conf (defaults and limits per user group):
+
+  * Small, Medium and Large take 1/8, 1/4 and 1/2 of the CPUs and of the
+    memory of the smallest compute node (the smallest in either, if the
+    node sizes differ), so they fit on every node.
+  * A Whole node profile per node size asks for all of its CPUs and its
+    RealMemory.
+
+Everyone may request up to the most CPUs and the most memory of any node,
+each taken on its own so that every whole node profile is within the
+limits, unless `whole_node_groups` are given: then only members of these groups get the whole node profiles and
+limits, everyone else is limited to Large.
+"""
+
+from dataclasses import dataclass, field
+from typing import Iterable, List
+
+from slurm_config import Partition
+
+# Fraction of the smallest node given by each profile: key, name, divisor
+FRACTIONS = [
+    ("small", "Small", 8),
+    ("medium", "Medium", 4),
+    ("large", "Large", 2),
+]
+
+# Memory of the fractional profiles is rounded down to a multiple of this (MiB)
+MEMORY_STEP = 256
+
+
+@dataclass(frozen=True)
+class ResourceProfile:
+    """A section of launcher.slurm.resources.conf."""
+    key: str
+    name: str
+    cpus: int
+    mem_mb: int
+
+
+@dataclass
+class ProfileLimits:
+    """A section of launcher.slurm.profiles.conf: `*`, `@group` or a user."""
+    match: str
+    default: ResourceProfile
+    max_cpus: int
+    max_mem_mb: int
+    profiles: List[str] = field(default_factory=list)
+
+
+def _node_sizes(partitions: Iterable[Partition]) -> List[tuple]:
+    sizes = sorted({(p.cpus, p.real_memory) for p in partitions})
+    if not sizes:
+        raise ValueError("resource profiles need at least one compute partition")
+    return sizes
+
+
+def resource_profiles(partitions: Iterable[Partition]) -> List[ResourceProfile]:
+    """Fractional profiles of the smallest node, then a whole node profile per node size."""
+    sizes = _node_sizes(partitions)
+    # Smallest in both dimensions, so that the fractions fit on every node
+    cpus = min(c for c, _ in sizes)
+    memory = min(m for _, m in sizes)
+
+    profiles: List[ResourceProfile] = []
+    for key, name, divisor in FRACTIONS:
+        profile = ResourceProfile(
+            key, name,
+            cpus=max(1, cpus // divisor),
+            mem_mb=max(MEMORY_STEP, memory // divisor // MEMORY_STEP * MEMORY_STEP),
+        )
+        # Small nodes give the same profile for several fractions
+        if not profiles or (profile.cpus, profile.mem_mb) != (profiles[-1].cpus, profiles[-1].mem_mb):
+            profiles.append(profile)
+
+    for c, m in sizes:
+        # Keyed on the exact memory: sizes less than a GiB apart must not share a section
+        key = "whole-node" if len(sizes) == 1 else f"whole-node-{c}cpu-{m}mb"
+        profiles.append(ResourceProfile(key, f"Whole node ({c} CPUs, {m / 1024:.1f} GiB)", c, m))
+    return profiles
+
+
+def profile_limits(
+    partitions: Iterable[Partition],
+    profiles: List[ResourceProfile],
+    whole_node_groups: Iterable[str] = (),
+) -> List[ProfileLimits]:
+    """Sections of launcher.slurm.profiles.conf for `profiles`."""
+    sizes = _node_sizes(partitions)
+    # Largest in each dimension, which may be two different nodes
+    cpus = max(c for c, _ in sizes)
+    memory = max(m for _, m in sizes)
+    default = profiles[0]
+    everything = ProfileLimits("*", default, cpus, memory, [p.key for p in profiles])
+
+    groups = list(whole_node_groups)
+    if not groups:
+        return [everything]
+    fractions = [p for p in profiles if not p.key.startswith("whole-node")]
+    largest = fractions[-1]
+    return [
+        ProfileLimits("*", default, largest.cpus, largest.mem_mb, [p.key for p in fractions]),
+    ] + [
+        ProfileLimits(f"@{group}", default, everything.max_cpus, everything.max_mem_mb, everything.profiles)
+        for group in groups
+    ]
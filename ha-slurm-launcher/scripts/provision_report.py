@@ -0,0 +1,190 @@
+"""Collect the provisioning step timings from every node and report on them.
+
+Each node's `provision.py` appends a JSON record per step to
+~/provision-logs/timings.jsonl. This script fetches those files over SSH from
+every server exported by the stack (`*_public_dns` outputs), keeps the latest
+run of each node and prints
+
+  * the bring-up time of every node,
+  * per role, the duration of each step across its nodes,
+  * the critical path of the deployment: the head node's chain of gating
+    steps followed by the one of the node that finished last.
+
+    python scripts/provision_report.py                 # collect and report
+    python scripts/provision_report.py --from-dir DIR  # report on saved files
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+REMOTE_TIMINGS = "provision-logs/timings.jsonl"
+
+
+# ------------------------------------------------------------------------------
+# Collection
+# ------------------------------------------------------------------------------
+
+def stack_hosts() -> Dict[str, str]:
+    """Server name -> public DNS name, from the current stack's outputs."""
+    outputs = json.loads(subprocess.check_output(["pulumi", "stack", "output", "--json"]))
+    suffix = "_public_dns"
+    return {k.removesuffix(suffix): v for k, v in outputs.items() if k.endswith(suffix)}
+
+
+def fetch(host: str, key: str) -> str:
+    proc = subprocess.run(
+        ["ssh", "-i", key, "-o", "StrictHostKeyChecking=no", "-o", "BatchMode=yes",
+         f"ubuntu@{host}", f"cat {REMOTE_TIMINGS}"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(f"no timings from {host}: {proc.stderr.strip()}", file=sys.stderr)
+        return ""
+    return proc.stdout
+
+
+def collect(out_dir: Path, key: str) -> None:
+    """Copy every node's timings file to `out_dir`/<server>.jsonl."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    hosts = stack_hosts()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        texts = pool.map(lambda host: fetch(host, key), hosts.values())
+        for name, text in zip(hosts, texts):
+            if text:
+                (out_dir / f"{name}.jsonl").write_text(text)
+
+
+def load(in_dir: Path) -> List[Dict]:
+    """Records of the latest run of every node, role and phase found in `in_dir`."""
+    records = []
+    for path in sorted(in_dir.glob("*.jsonl")):
+        records += [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+    # A node provisioned in an early and a late phase has one run of each
+    key = lambda r: (r["node"], r["role"], r.get("phase", "all"))
+    latest = {}
+    for r in records:
+        latest[key(r)] = max(latest.get(key(r), r["run"]), r["run"])
+    return [r for r in records if r["run"] == latest[key(r)]]
+
+
+# ------------------------------------------------------------------------------
+# Report
+# ------------------------------------------------------------------------------
+
+def duration(record: Dict) -> float:
+    return record["end"] - record["start"]
+
+
+def by_node(records: List[Dict]) -> Dict[str, Dict[str, Dict]]:
+    nodes = defaultdict(dict)
+    for r in records:
+        nodes[r["node"]][r["step"]] = r
+    return nodes
+
+
+def critical_path(steps: Dict[str, Dict]) -> List[Dict]:
+    """Chain of steps that gated the end of a node's bring-up, first step first.
+
+    Starting at the step that ended last, repeatedly move to the step it came
+    after that ended last, i.e. the one it had to wait for.
+    """
+    current = max(steps.values(), key=lambda r: r["end"])
+    chain = [current]
+    while True:
+        before = [steps[name] for name in current["after"] if name in steps]
+        if not before:
+            return chain[::-1]
+        current = max(before, key=lambda r: r["end"])
+        chain.append(current)
+
+
+def print_nodes(nodes: Dict[str, Dict[str, Dict]], origin: float) -> None:
+    print(f"{'node':<28} {'role':<10} {'start':>7} {'wall':>7} {'failed':>7} {'skipped':>8} {'unchanged':>10}")
+    for node, steps in sorted(nodes.items(), key=lambda n: min(r["start"] for r in n[1].values())):
+        records = list(steps.values())
+        start = min(r["start"] for r in records)
+        end = max(r["end"] for r in records)
+        failed = sum(1 for r in records if r["exit_code"] not in (0, None))
+        skipped = sum(1 for r in records if r["exit_code"] is None)
+        unchanged = sum(1 for r in records if r.get("unchanged"))
+        print(f"{node:<28} {records[0]['role']:<10} {start - origin:>6.0f}s {end - start:>6.0f}s {failed:>7} {skipped:>8} {unchanged:>10}")
+
+
+def print_roles(records: List[Dict]) -> None:
+    roles = defaultdict(lambda: defaultdict(list))
+    for r in records:
+        # Steps not run as their inputs were unchanged say nothing about their duration
+        if r["exit_code"] is not None and not r.get("unchanged"):
+            roles[r["role"]][r["step"]].append(duration(r))
+    for role, steps in sorted(roles.items()):
+        print(f"\n{role} ({max(len(d) for d in steps.values())} nodes)")
+        print(f"  {'step':<32} {'min':>7} {'median':>7} {'max':>7}")
+        for step, durations in sorted(steps.items(), key=lambda s: -statistics.median(s[1])):
+            print(f"  {step:<32} {min(durations):>6.0f}s {statistics.median(durations):>6.0f}s {max(durations):>6.0f}s")
+
+
+def print_chain(node: str, chain: List[Dict], origin: float) -> None:
+    print(f"  {node}")
+    previous_end = None
+    for r in chain:
+        # Time between the gating step's end and this start was spent
+        # waiting for a free worker or for a lock
+        queued = r["start"] - previous_end if previous_end is not None else 0
+        wait = f"  (queued {queued:.0f}s)" if queued >= 1 else ""
+        print(f"    {r['start'] - origin:>6.0f}s {duration(r):>6.0f}s  {r['step']}{wait}")
+        previous_end = r["end"]
+
+
+def print_critical_path(nodes: Dict[str, Dict[str, Dict]], origin: float) -> None:
+    # Every other node's `do-it` waits for the head node's, so the deployment
+    # is the head node's bring-up followed by the slowest of the others.
+    head = [n for n, steps in nodes.items() if next(iter(steps.values()))["role"] == "head"]
+    others = [n for n in nodes if n not in head]
+    last_end = lambda n: max(r["end"] for r in nodes[n].values())
+
+    print("\ncritical path (offset from deployment start, duration)")
+    if head:
+        print_chain(head[0], critical_path(nodes[head[0]]), origin)
+    if others:
+        slowest = max(others, key=last_end)
+        if head:
+            gap = min(r["start"] for r in nodes[slowest].values()) - last_end(head[0])
+            print(f"    ... {gap:.0f}s until {slowest} started")
+        print_chain(slowest, critical_path(nodes[slowest]), origin)
+    total = max(last_end(n) for n in nodes) - origin
+    print(f"\ntotal provisioning time: {total:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--from-dir", type=Path, help="report on timings collected earlier instead of fetching them")
+    parser.add_argument("--out-dir", type=Path, default=Path("provision-timings"),
+                        help="where to store the fetched timings (default: provision-timings)")
+    parser.add_argument("--key", default="key.pem", help="SSH private key (default: key.pem)")
+    args = parser.parse_args()
+
+    in_dir = args.from_dir
+    if in_dir is None:
+        collect(args.out_dir, args.key)
+        in_dir = args.out_dir
+
+    records = load(in_dir)
+    if not records:
+        sys.exit(f"no timing records in {in_dir}")
+    nodes = by_node(records)
+    origin = min(r["start"] for r in records)
+
+    print_nodes(nodes, origin)
+    print_roles(records)
+    print_critical_path(nodes, origin)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Create AD users and group memberships in bulk.
+
+Users come from a CSV file (columns `username`, `password` and optionally
+`groups`, separated by spaces or semicolons), a YAML file with a `users`
+list of the same keys, or are generated as positXXXX test users:
+
+    python3 bulk_users.py users.csv --workers 8
+    python3 bulk_users.py users.yaml
+    python3 bulk_users.py --generate 500 --password Testme1234
+
+Existing users, groups and memberships are looked up with one LDAP query up
+front and skipped, so re-running with the same list only creates what is
+missing.
+Users are created by a bounded pool of workers, each running
+create-users.exp (adcli create-user + passwd-user). Missing groups are then
+created and members added with one `adcli add-member` per group and batch.
+The domain and the Administrator password are read from AD_DOMAIN and
+AD_PASSWD, as set in ~/.env.
+"""
+
+import argparse
+import csv
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+HOME = os.path.expanduser("~")
+ADCLI = "/usr/local/sbin/adcli"
+
+# Members added per `adcli add-member` call
+MEMBER_BATCH = 100
+
+
+@dataclass
+class User:
+    username: str
+    password: str
+    groups: List[str] = field(default_factory=list)
+
+
+def read_users(path: str) -> List[User]:
+    """Users from a CSV or YAML file, see the module docstring."""
+    if path.endswith((".yaml", ".yml")):
+        import yaml
+        with open(path) as f:
+            rows = yaml.safe_load(f)["users"]
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+    users = []
+    for row in rows:
+        groups = row.get("groups") or []
+        if isinstance(groups, str):
+            groups = re.split(r"[;\s]+", groups.strip())
+        users.append(User(str(row["username"]), str(row["password"]), [g for g in groups if g]))
+    return users
+
+
+def generated_users(count: int, password: str, start: int = 1, groups: Optional[List[str]] = None) -> List[User]:
+    """positXXXX test users, as created by `just create-users` before."""
+    return [User(f"posit{i:04d}", password, list(groups or [])) for i in range(start, start + count)]
+
+
+# ------------------------------------------------------------------------------
+# AD
+# ------------------------------------------------------------------------------
+
+class Directory:
+    def __init__(self, domain: str, admin_password: str):
+        self.domain = domain
+        self.admin_password = admin_password
+        self.base = ",".join(f"dc={part}" for part in domain.split("."))
+
+    def lookup(self) -> Optional[Tuple[Dict[str, Set[str]], Set[str]]]:
+        """Groups of every user and the set of groups, lower case; None if LDAP can't be queried."""
+        proc = subprocess.run(
+            ["ldapsearch", "-LLL", "-o", "ldif-wrap=no", "-x", "-H", f"ldap://{self.domain}",
+             "-D", f"Administrator@{self.domain}", "-w", self.admin_password,
+             "-b", self.base, "-E", "pr=1000/noprompt",
+             "(|(objectClass=user)(objectClass=group))", "sAMAccountName", "objectClass", "memberOf"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        if proc.returncode != 0:
+            print(f"LDAP lookup failed, checking accounts one by one: {proc.stderr.strip()}", file=sys.stderr)
+            return None
+        users: Dict[str, Set[str]] = {}
+        groups: Set[str] = set()
+        for entry in proc.stdout.split("\n\n"):
+            attributes = defaultdict(list)
+            for line in entry.splitlines():
+                key, _, value = line.partition(": ")
+                attributes[key.lower()].append(value.strip())
+            if not attributes["samaccountname"]:
+                continue
+            name = attributes["samaccountname"][0].lower()
+            classes = {c.lower() for c in attributes["objectclass"]}
+            if "group" in classes:
+                groups.add(name)
+            elif "user" in classes:
+                # memberOf holds DNs; groups created by adcli are named by their CN
+                users[name] = {dn.split(",")[0].partition("=")[2].lower() for dn in attributes["memberof"]}
+        return users, groups
+
+    @staticmethod
+    def resolves(database: str, name: str) -> bool:
+        """Whether sssd knows `name` (getent passwd/group)."""
+        return subprocess.call(["getent", database, name], stdout=subprocess.DEVNULL) == 0
+
+    @staticmethod
+    def groups_of(username: str) -> Set[str]:
+        """Groups of `username` according to sssd."""
+        proc = subprocess.run(["id", "-nG", username], stdout=subprocess.PIPE, universal_newlines=True)
+        return set(proc.stdout.lower().split())
+
+    def create_user(self, user: User) -> bool:
+        proc = subprocess.run(
+            ["expect", os.path.join(HOME, "create-users.exp"), user.username, user.password],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+        )
+        # The expect script always exits 0, look for adcli's errors instead
+        return proc.returncode == 0 and "adcli:" not in proc.stdout
+
+    def _adcli(self, *args: str) -> bool:
+        proc = subprocess.run(
+            [ADCLI, *args, "-D", self.domain, "--stdin-password"],
+            input=self.admin_password + "\n", stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        if proc.returncode != 0:
+            print(f"adcli {args[0]} {args[1]} failed: {proc.stdout.strip()}", file=sys.stderr)
+        return proc.returncode == 0
+
+    def create_group(self, group: str) -> bool:
+        return self._adcli("create-group", group)
+
+    def add_members(self, group: str, usernames: List[str]) -> bool:
+        return self._adcli("add-member", group, *usernames)
+
+
+# ------------------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------------------
+
+class Progress:
+    def __init__(self, total: int, every: int = 50):
+        self.total = total
+        self.every = every
+        self.done = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def step(self) -> None:
+        with self._lock:
+            self.done += 1
+            if self.done % self.every == 0 or self.done == self.total:
+                elapsed = time.monotonic() - self.start
+                print(f"{self.done}/{self.total} users ({self.done / elapsed:.1f}/s)", flush=True)
+
+
+def provision(users: List[User], directory: Directory, workers: int) -> bool:
+    """Create the missing users, groups and memberships; True if nothing failed."""
+    start = time.monotonic()
+    existing = directory.lookup()
+
+    def user_exists(name: str) -> bool:
+        if existing is not None:
+            return name.lower() in existing[0]
+        return directory.resolves("passwd", name)
+
+    def group_exists(name: str) -> bool:
+        if existing is not None:
+            return name.lower() in existing[1]
+        return directory.resolves("group", name)
+
+    def is_member(name: str, group: str) -> bool:
+        if existing is not None:
+            return group.lower() in existing[0].get(name.lower(), set())
+        return group.lower() in directory.groups_of(name)
+
+    missing = [u for u in users if not user_exists(u.username)]
+    print(f"{len(users)} users, {len(users) - len(missing)} exist already, creating {len(missing)} "
+          f"with {workers} workers", flush=True)
+
+    progress = Progress(len(missing))
+    failed_users: List[str] = []
+
+    def create(user: User) -> None:
+        if not directory.create_user(user):
+            failed_users.append(user.username)
+        progress.step()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(create, missing))
+    users_seconds = time.monotonic() - start
+
+    # Missing group memberships of the users that exist now
+    failed = set(failed_users)
+    members: Dict[str, List[str]] = defaultdict(list)
+    for u in users:
+        if u.username not in failed:
+            for g in u.groups:
+                if not is_member(u.username, g):
+                    members[g].append(u.username)
+    failed_groups = []
+    new_groups = [g for g in members if not group_exists(g)]
+    for g in new_groups:
+        if not directory.create_group(g):
+            failed_groups.append(g)
+    batches = [
+        (g, names[i:i + MEMBER_BATCH])
+        for g, names in members.items() if g not in failed_groups
+        for i in range(0, len(names), MEMBER_BATCH)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda b: directory.add_members(*b), batches))
+    failed_groups += sorted({g for (g, _), ok in zip(batches, results) if not ok})
+
+    total = time.monotonic() - start
+    created = len(missing) - len(failed_users)
+    print(f"\nusers:  {created} created, {len(users) - len(missing)} skipped, {len(failed_users)} failed"
+          f" in {users_seconds:.0f}s ({created / users_seconds if users_seconds else 0:.1f} users/s)")
+    print(f"groups: {len(new_groups)} created, {sum(len(m) for m in members.values())} memberships"
+          f" in {len(batches)} batches, {len(failed_groups)} groups failed")
+    print(f"total:  {total:.0f}s")
+    if failed_users:
+        print(f"failed users: {' '.join(sorted(failed_users))}", file=sys.stderr)
+    if failed_groups:
+        print(f"failed groups: {' '.join(failed_groups)}", file=sys.stderr)
+    return not failed_users and not failed_groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("users", nargs="?", help="CSV or YAML file with the users")
+    parser.add_argument("--generate", type=int, metavar="N", help="create N positXXXX test users instead")
+    parser.add_argument("--start", type=int, default=1, help="number of the first generated user (default: 1)")
+    parser.add_argument("--password", default="Testme1234", help="password of generated users")
+    parser.add_argument("--group", action="append", default=[], help="group every generated user joins")
+    parser.add_argument("--workers", type=int, default=8, help="users created in parallel (default: 8)")
+    args = parser.parse_args()
+
+    if args.users:
+        users = read_users(args.users)
+    elif args.generate:
+        users = generated_users(args.generate, args.password, args.start, args.group)
+    else:
+        parser.error("give a user list or --generate N")
+
+    directory = Directory(os.environ["AD_DOMAIN"], os.environ["AD_PASSWD"])
+    sys.exit(0 if provision(users, directory, max(1, args.workers)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/bin/bash
+# Serve the cluster's shared storage from this node over NFS.
+#
+#   sudo bash nfs_server.sh <client CIDR> [nfsd threads]
+#
+# The blank EBS data volume is formatted (label `nfs`, mounted again when
+# present) and mounted on /srv/nfs, which is exported as the NFSv4 root to
+# the clients, so that they mount <server>:/ like the root of an EFS file
+# system. The exports are asynchronous (the server acknowledges writes once
+# they are in its page cache) and without root squashing, as the nodes
+# create files as root for other users. More nfsd threads than the default
+# 8 keep many clients with several connections each (nconnect) busy.
+set -euo pipefail
+
+CLIENTS=$1
+THREADS=${2:-64}
+EXPORT=/srv/nfs
+LABEL=nfs
+
+blank_device() {
+    for d in $(lsblk -dpno NAME,TYPE | awk '$2 == "disk" {print $1}'); do
+        # No partitions, no file system and not mounted
+        if [ "$(lsblk -no NAME "$d" | wc -l)" -eq 1 ] && [ -z "$(lsblk -no FSTYPE,MOUNTPOINT "$d" | tr -d '[:space:]')" ]; then
+            echo $d
+            return
+        fi
+    done
+}
+
+export DEBIAN_FRONTEND=noninteractive
+if ! dpkg -s nfs-kernel-server >/dev/null 2>&1; then
+    apt-get update
+    apt-get install -y nfs-kernel-server
+fi
+
+mkdir -p $EXPORT
+if ! mountpoint -q $EXPORT; then
+    if [ ! -e /dev/disk/by-label/$LABEL ]; then
+        device=$(blank_device)
+        if [ -n "$device" ]; then
+            echo "formatting $device for $EXPORT"
+            mkfs.ext4 -q -F -L $LABEL -E nodiscard $device
+            udevadm settle
+        fi
+    fi
+    if [ -e /dev/disk/by-label/$LABEL ]; then
+        grep -qs " $EXPORT " /etc/fstab || echo "LABEL=$LABEL $EXPORT ext4 noatime,nofail 0 2" >> /etc/fstab
+        mount $EXPORT
+    else
+        echo "no data volume, $EXPORT stays on the root volume"
+    fi
+fi
+chmod 755 $EXPORT
+
+mkdir -p /etc/exports.d
+echo "$EXPORT $CLIENTS(rw,async,no_subtree_check,no_root_squash,fsid=0)" > /etc/exports.d/cluster.exports
+sed -i "s/^RPCNFSDCOUNT=.*/RPCNFSDCOUNT=$THREADS/" /etc/default/nfs-kernel-server
+systemctl enable nfs-kernel-server
+systemctl restart nfs-kernel-server
+exportfs -ra
+exportfs -v
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Provision a node by running its justfile recipes as a dependency graph.
+
+Every step is a `just` recipe. A step starts once all steps it comes `after`
+have succeeded, at most `--jobs` steps run at the same time, and steps that
+share a lock (e.g. everything that runs apt/dpkg/gdebi) never overlap. Steps
+are started in the order they are declared, so long-running downloads and
+builds are listed early. If a step fails, the steps depending on it are
+skipped, every other step still runs and the exit status is non-zero.
+
+    python3 provision.py workbench --jobs 4
+    python3 provision.py head --list
+
+Steps marked `late` need the directory or the databases, directly or through
+the files rendered from them. With `--phase early` only the steps that
+depend on none of them run (packages, builds, downloads), so a node can get
+going as soon as it is reachable; `--phase late` then runs the rest and
+takes the early steps as done.
+
+Each step that succeeds leaves a stamp in <stamp-dir>/<step> with the digest
+of its inputs: the recipe as `just --dry-run` evaluates it with the values
+from .env, the files in the home directory it reads (`inputs`) and the
+digests of the steps it comes after. A step whose stamp matches is not run
+again, so re-provisioning a node only runs the steps whose inputs changed
+and the steps after them. `--force` runs every step regardless.
+
+Each step's output goes to <log-dir>/<step>.log. A timing record per step
+(node, role, step, start, end, exit code) is appended as one JSON line to
+<log-dir>/timings.jsonl, see scripts/provision_report.py for the report.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Held by every step that installs packages: apt-get, dpkg and gdebi refuse
+# to run while another one holds the dpkg lock.
+DPKG = "dpkg"
+
+# Config files rendered by pulumi that configure-rsw copies
+RSW_CONFIG_FILES = [
+    "rserver.conf", "load-balancer", "database.conf", "launcher.conf", "launcher.slurm.conf",
+    "launcher.slurm.resources.conf", "launcher.slurm.profiles.conf", "logging.conf",
+]
+
+
+@dataclass
+class Step:
+    """A `just` recipe (with arguments) and what it has to wait for."""
+    command: List[str]
+    after: List[str] = field(default_factory=list)
+    locks: List[str] = field(default_factory=list)
+    late: bool = False
+    # Files in the home directory the recipe reads, part of the step's stamp
+    inputs: List[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.command[0]
+
+
+# ------------------------------------------------------------------------------
+# Step graphs per node role
+# ------------------------------------------------------------------------------
+
+def common_steps(role: str) -> List[Step]:
+    """AD integration and EFS mount, needed on every node."""
+    apt = "apt-install-role"
+    return [
+        Step([apt, role]),
+        # Builds and downloads only need the shared caches, start them first
+        Step(["adcli-artifact"], after=[apt]),
+        Step(["efs-utils-artifact"], after=[apt]),
+        Step(["install-linux-tools"], after=[apt], locks=[DPKG]),
+        Step(["install-ad-prereqs"], after=[apt], locks=[DPKG]),
+        Step(["update-etchosts"], after=[apt], locks=[DPKG]),
+        Step(["install-adcli"], after=["adcli-artifact"], locks=[DPKG]),
+        # krb5.conf and resolv.conf point at the directory's DNS servers
+        Step(["copy-ad-files"], after=[apt], late=True, inputs=["krb5.conf", "resolv.conf"]),
+        Step(["join-ad"], after=["install-adcli", "install-ad-prereqs", "update-etchosts", "copy-ad-files"],
+             inputs=["sssd.conf"]),
+        Step(["sssd-warm-cache"], after=["join-ad"]),
+        Step(["install-efs-utils"], after=["efs-utils-artifact"], locks=[DPKG]),
+        # Files on /efs (home directories, configs) are owned by AD users,
+        # so only mount it once the node resolves them
+        Step(["mount-efs"], after=["install-efs-utils", "join-ad"]),
+        Step(["munge-setup"], after=[apt], locks=[DPKG]),
+        Step(["slurm-path"]),
+    ]
+
+
+def workbench_steps() -> List[Step]:
+    return [
+        Step(["fetch-r"], after=["apt-install-role"]),
+        Step(["fetch-rsw"], after=["apt-install-role"]),
+    ] + common_steps("workbench") + [
+        Step(["munge-key-copy"], after=["munge-setup", "mount-efs"]),
+        Step(["pwb-shared-storage"], after=["mount-efs"]),
+        # The launcher runs the Slurm commands, staged on EFS by the head node
+        Step(["slurm-local-install"], after=["mount-efs"]),
+        Step(["install-r"], after=["fetch-r"], locks=[DPKG]),
+        Step(["symlink-r"], after=["install-r"]),
+        # Both edit Renviron.site
+        Step(["r-site-library"], after=["install-r"], inputs=["r-packages.txt"]),
+        Step(["scratch-setup"], after=["install-r", "r-site-library"], inputs=["scratch_setup.sh"]),
+        Step(["install-rsw"], after=["fetch-rsw"], locks=[DPKG]),
+        Step(["generate-cookie-key"], after=["install-rsw", "mount-efs"], locks=[DPKG]),
+        Step(["configure-rsw"], after=["install-rsw", "mount-efs"], late=True, inputs=RSW_CONFIG_FILES),
+        Step(["setup-rsw-systemctl-overrides"], after=["install-rsw"]),
+        Step(["install-launcher-ssl"], after=["install-rsw"], locks=[DPKG]),
+        Step(["restart-clean"], after=[
+            "install-linux-tools", "munge-key-copy", "slurm-path", "slurm-local-install", "pwb-shared-storage", "symlink-r",
+            "generate-cookie-key", "configure-rsw", "setup-rsw-systemctl-overrides", "install-launcher-ssl", "scratch-setup",
+            "r-site-library",
+        ]),
+    ]
+
+
+def compute_steps() -> List[Step]:
+    return [
+        Step(["fetch-r"], after=["apt-install-role"]),
+        Step(["fetch-session-components"], after=["apt-install-role"]),
+    ] + common_steps("compute") + [
+        Step(["slurm-run-osdeps"], after=["apt-install-role"], locks=[DPKG]),
+        # slurmd refuses to start without the cluster's munge key
+        Step(["munge-key-copy"], after=["munge-setup", "mount-efs"]),
+        Step(["slurm-local-install"], after=["mount-efs"]),
+        Step(["start-slurmd"], after=["munge-key-copy", "slurm-run-osdeps", "slurm-local-install"]),
+        Step(["pwb-session-components"], after=["fetch-session-components"], locks=[DPKG]),
+        Step(["install-r"], after=["fetch-r"], locks=[DPKG]),
+        Step(["r-site-library"], after=["install-r"], inputs=["r-packages.txt"]),
+        # Sets TMPDIR for the R installed above
+        Step(["scratch-setup"], after=["install-r", "r-site-library"], inputs=["scratch_setup.sh"]),
+    ]
+
+
+def head_steps() -> List[Step]:
+    return [
+        Step(["slurm-build-osdeps"], after=["apt-install-role"], locks=[DPKG]),
+        Step(["slurm-artifact"], after=["slurm-build-osdeps"]),
+    ] + common_steps("head") + [
+        Step(["munge-config"], after=["munge-setup", "mount-efs"]),
+        Step(["slurm-logs-prepare"], after=["munge-setup", "mount-efs"]),
+        Step(["slurm-compile-and-install"], after=["slurm-artifact", "mount-efs"]),
+        Step(["slurm-copy-config"], after=["slurm-compile-and-install", "slurm-logs-prepare"], late=True,
+             inputs=["slurm.conf", "slurmdbd.conf"]),
+        Step(["slurm-config"], after=["slurm-copy-config"]),
+        Step(["slurm-power-install"], after=["slurm-logs-prepare"], locks=[DPKG],
+             inputs=["slurm-power.conf", "slurm_power.py"]),
+        Step(["slurm-start-daemons"], after=["slurm-config", "munge-config", "slurm-power-install"]),
+    ]
+
+
+ROLES = {
+    "workbench": workbench_steps,
+    "compute": compute_steps,
+    "head": head_steps,
+}
+
+PHASES = ["early", "late", "all"]
+
+
+def late_steps(steps: List[Step]) -> Set[str]:
+    """Names of the late steps and of every step that comes after one of them."""
+    late = set()
+    for s in topological_order(steps):
+        if s.late or late & set(s.after):
+            late.add(s.name)
+    return late
+
+
+def phase_steps(steps: List[Step], phase: str) -> Tuple[List[Step], Set[str]]:
+    """Steps to run in `phase` and the steps to take as done."""
+    late = late_steps(steps)
+    early = [s for s in steps if s.name not in late]
+    if phase == "early":
+        return early, set()
+    if phase == "late":
+        return [s for s in steps if s.name in late], {s.name for s in early}
+    return steps, set()
+
+
+def validate(steps: List[Step], done: Set[str] = frozenset()) -> None:
+    """Raise ValueError on duplicate or unknown step names and on cycles."""
+    names = [s.name for s in steps]
+    duplicates = {n for n in names if names.count(n) > 1}
+    if duplicates:
+        raise ValueError(f"duplicate steps: {', '.join(sorted(duplicates))}")
+    for s in steps:
+        unknown = set(s.after) - set(names) - done
+        if unknown:
+            raise ValueError(f"{s.name} comes after unknown steps: {', '.join(sorted(unknown))}")
+    if len(topological_order(steps, done)) != len(steps):
+        raise ValueError("the step graph has a cycle")
+
+
+def topological_order(steps: List[Step], done: Set[str] = frozenset()) -> List[Step]:
+    """Steps in declaration order, each moved behind the steps it comes after."""
+    ordered, placed = [], set(done)
+    remaining = list(steps)
+    while remaining:
+        ready = [s for s in remaining if set(s.after) <= placed]
+        if not ready:
+            break
+        ordered.append(ready[0])
+        placed.add(ready[0].name)
+        remaining.remove(ready[0])
+    return ordered
+
+
+# ------------------------------------------------------------------------------
+# Stamps
+# ------------------------------------------------------------------------------
+
+class Stamps:
+    """Input digests of the steps that succeeded, one file per step in `directory`."""
+
+    def __init__(self, directory: str, steps: List[Step], force: bool = False):
+        self.directory = directory
+        self.steps = {s.name: s for s in steps}
+        self.force = force
+        self._digests: Dict[str, str] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def digest(self, name: str) -> str:
+        """Digest of the inputs of step `name`, including those of the steps before it."""
+        if name not in self._digests:
+            step = self.steps[name]
+            h = hashlib.sha256()
+            # The dry run prints the recipe's commands with every variable filled in
+            proc = subprocess.run(["just", "--dry-run"] + step.command, cwd=HERE,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            h.update(proc.stdout + proc.stderr + str(proc.returncode).encode())
+            for path in step.inputs:
+                h.update(f"\0{path}\0".encode())
+                try:
+                    with open(os.path.join(HERE, path), "rb") as f:
+                        h.update(f.read())
+                except FileNotFoundError:
+                    h.update(b"missing")
+            for before in sorted(step.after):
+                if before in self.steps:
+                    h.update(self.digest(before).encode())
+            self._digests[name] = h.hexdigest()
+        return self._digests[name]
+
+    def _path(self, step: Step) -> str:
+        return os.path.join(self.directory, step.name)
+
+    def current(self, step: Step) -> bool:
+        """Whether `step` succeeded before with the inputs it has now."""
+        if self.force:
+            return False
+        try:
+            with open(self._path(step)) as f:
+                return f.read().strip() == self.digest(step.name)
+        except FileNotFoundError:
+            return False
+
+    def record(self, step: Step, ok: bool) -> None:
+        if ok:
+            with open(self._path(step), "w") as f:
+                f.write(self.digest(step.name) + "\n")
+        elif os.path.exists(self._path(step)):
+            os.remove(self._path(step))
+
+
+# ------------------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------------------
+
+_print_lock = threading.Lock()
+
+
+def report(message: str) -> None:
+    with _print_lock:
+        print(f"{time.strftime('%H:%M:%S')} {message}", flush=True)
+
+
+class TimingLog:
+    """Appends one JSON record per step to `path`.
+
+    Records of one `provision.py` invocation share the same `run` (its start
+    time), so that a report can tell re-runs apart, and its `phase`.
+    """
+
+    def __init__(self, path: str, role: str, phase: str):
+        self.path = path
+        self.base = {"node": socket.gethostname(), "role": role, "phase": phase, "run": round(time.time(), 3)}
+        self._lock = threading.Lock()
+
+    def record(self, step: Step, start: float, end: float, exit_code, unchanged: bool = False) -> None:
+        entry = {
+            **self.base,
+            "step": step.name,
+            "after": step.after,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "exit_code": exit_code,
+            "unchanged": unchanged,
+        }
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def run_step(step: Step, log_dir: str, timings: TimingLog, stamps: Optional[Stamps] = None) -> bool:
+    log = os.path.join(log_dir, f"{step.name}.log")
+    report(f"start  {step.name}")
+    start = time.time()
+    with open(log, "w") as f:
+        rc = subprocess.call(["just"] + step.command, cwd=HERE, stdout=f, stderr=subprocess.STDOUT)
+    end = time.time()
+    timings.record(step, start, end, rc)
+    if stamps is not None:
+        stamps.record(step, rc == 0)
+    if rc == 0:
+        report(f"done   {step.name} ({end - start:.0f}s)")
+    else:
+        with open(log) as f:
+            tail = "".join(f.readlines()[-20:])
+        report(f"FAILED {step.name} ({end - start:.0f}s, exit {rc}), end of {log}:\n{tail}")
+    return rc == 0
+
+
+def run(
+    steps: List[Step],
+    jobs: int,
+    log_dir: str,
+    timings: TimingLog,
+    done: Set[str] = frozenset(),
+    stamps: Optional[Stamps] = None,
+) -> bool:
+    """Run `steps` with at most `jobs` in parallel; True if all of them succeeded.
+
+    Steps in `done` are not run, the steps coming after them can start right away.
+    Steps whose stamp is current succeed without running.
+    """
+    validate(steps, done)
+    pending: Dict[str, Step] = {s.name: s for s in steps}
+    succeeded, failed = set(done), set()
+    running, held = {}, set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for s in list(pending.values()):
+                if failed & set(s.after):
+                    report(f"skip   {s.name} (after failed {', '.join(sorted(failed & set(s.after)))})")
+                    # Skipped steps are recorded without an exit code
+                    now = time.time()
+                    timings.record(s, now, now, None)
+                    failed.add(s.name)
+                    del pending[s.name]
+
+            unchanged = False
+            for s in list(pending.values()):
+                if len(running) >= jobs:
+                    break
+                if set(s.after) <= succeeded and not held & set(s.locks):
+                    del pending[s.name]
+                    if stamps is not None and stamps.current(s):
+                        report(f"same   {s.name} (inputs unchanged)")
+                        now = time.time()
+                        timings.record(s, now, now, 0, unchanged=True)
+                        succeeded.add(s.name)
+                        unchanged = True
+                        continue
+                    held |= set(s.locks)
+                    running[pool.submit(run_step, s, log_dir, timings, stamps)] = s
+
+            if not running:
+                # Steps after the unchanged ones may be ready now
+                if unchanged:
+                    continue
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                held -= set(s.locks)
+                (succeeded if future.result() else failed).add(s.name)
+
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("role", choices=sorted(ROLES))
+    parser.add_argument("--jobs", type=int, default=4, help="steps to run in parallel (default: 4)")
+    parser.add_argument("--log-dir", default=os.path.expanduser("~/provision-logs"),
+                        help="directory for the per-step logs (default: ~/provision-logs)")
+    parser.add_argument("--phase", choices=PHASES, default="all",
+                        help="run only the early or the late steps (default: all)")
+    parser.add_argument("--stamp-dir", default=os.path.expanduser("~/provision-stamps"),
+                        help="directory for the input digests of the steps (default: ~/provision-stamps)")
+    parser.add_argument("--force", action="store_true", help="run every step, even if its inputs are unchanged")
+    parser.add_argument("--list", action="store_true", help="print the steps in a valid order and exit")
+    args = parser.parse_args()
+
+    all_steps = ROLES[args.role]()
+    validate(all_steps)
+    steps, done = phase_steps(all_steps, args.phase)
+    if args.list:
+        late = late_steps(all_steps)
+        for s in topological_order(steps, done):
+            locks = f"  [{', '.join(s.locks)}]" if s.locks else ""
+            phase = "late " if s.name in late else "early"
+            print(f"{phase} {' '.join(s.command):<32} after: {', '.join(s.after) or '-'}{locks}")
+        return
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    timings = TimingLog(os.path.join(args.log_dir, "timings.jsonl"), args.role, args.phase)
+    start = time.monotonic()
+    stamps = Stamps(args.stamp_dir, all_steps, force=args.force)
+    ok = run(steps, max(1, args.jobs), args.log_dir, timings, done, stamps)
+    report(f"{args.role} {args.phase} provisioning {'finished' if ok else 'FAILED'} after {time.monotonic() - start:.0f}s")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/bin/bash
+# Mount local scratch space on /scratch for session and build temp files.
+#
+# The node's instance store volumes are used if it has any (striped into one
+# RAID 0 array if there are several), otherwise blank EBS data volumes. The
+# file system is labelled `scratch` and mounted again when present. Instance
+# store is empty after the instance was stopped, so this runs on every boot
+# (scratch-setup.service) and formats whatever it finds blank. Without any
+# such device, /scratch is a directory on the root volume.
+#
+# /scratch/tmp is created world-writable (sticky) for TMPDIR.
+set -euo pipefail
+
+SCRATCH=${SCRATCH:-/scratch}
+LABEL=scratch
+
+blank_devices() {
+    local devices
+    devices=$(lsblk -dpno NAME,MODEL | awk '/Instance Storage/ {print $1}')
+    if [ -z "$devices" ]; then
+        for d in $(lsblk -dpno NAME,TYPE | awk '$2 == "disk" {print $1}'); do
+            # No partitions, no file system and not mounted
+            if [ "$(lsblk -no NAME "$d" | wc -l)" -eq 1 ] && [ -z "$(lsblk -no FSTYPE,MOUNTPOINT "$d" | tr -d '[:space:]')" ]; then
+                devices="$devices $d"
+            fi
+        done
+    fi
+    echo $devices
+}
+
+mkdir -p $SCRATCH
+if ! mountpoint -q $SCRATCH; then
+    device=""
+    if [ -e /dev/disk/by-label/$LABEL ]; then
+        device=/dev/disk/by-label/$LABEL
+    else
+        set -- $(blank_devices)
+        if [ $# -gt 1 ]; then
+            mdadm --create /dev/md/$LABEL --level=0 --raid-devices=$# --run "$@"
+            device=/dev/md/$LABEL
+        elif [ $# -eq 1 ]; then
+            device=$1
+        fi
+        if [ -n "$device" ]; then
+            echo "formatting $* for $SCRATCH"
+            mkfs.ext4 -q -F -L $LABEL -E nodiscard $device
+        fi
+    fi
+    if [ -n "$device" ]; then
+        mount -o noatime $device $SCRATCH
+    else
+        echo "no local scratch device, $SCRATCH stays on the root volume"
+    fi
+fi
+mkdir -p $SCRATCH/tmp
+chmod 1777 $SCRATCH/tmp
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Start and stop the EC2 instances of elastic Slurm compute nodes.
+
+slurmctld runs this as ResumeProgram and SuspendProgram (through the
+slurm-resume and slurm-suspend wrappers) with a Slurm hostlist of the nodes
+to power up or down:
+
+    slurm-power resume ip-172-31-5-[7,12-13]
+    slurm-power suspend ip-172-31-5-7
+    slurm-power status
+
+The instance id of every node is read from /etc/slurm-power.conf, rendered
+by pulumi. EC2 is called through the AWS CLI with the credentials of the
+instance profile. With SLURM_POWER_EC2=local:<file> a stand-in that keeps
+the instance states in a JSON file is used instead, so the programs can be
+tried without AWS:
+
+    echo '{"i-0123": "stopped"}' > ec2.json
+    SLURM_POWER_EC2=local:ec2.json SLURM_POWER_CONF=slurm-power.conf SLURM_POWER_LOG=- \\
+        python3 slurm_power.py resume ip-172-31-5-7
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+CONF = os.environ.get("SLURM_POWER_CONF", "/etc/slurm-power.conf")
+LOG = os.environ.get("SLURM_POWER_LOG", "/var/log/slurm/power.log")
+
+# Instance ids per EC2 API call
+BATCH = 50
+
+_RANGE = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+
+class Ec2Error(Exception):
+    pass
+
+
+def expand_hostlist(expression: str) -> List[str]:
+    """Hostnames of a Slurm hostlist such as `node[01-03,7],other`, zero padding kept."""
+    hosts, part, depth = [], "", 0
+    for c in expression + ",":
+        depth += {"[": 1, "]": -1}.get(c, 0)
+        if c == "," and depth == 0:
+            if part:
+                hosts += _expand_one(part)
+            part = ""
+        else:
+            part += c
+    return hosts
+
+
+def _expand_one(name: str) -> List[str]:
+    if "[" not in name:
+        return [name]
+    prefix, rest = name.split("[", 1)
+    ranges, suffix = rest.split("]", 1)
+    hosts = []
+    for r in ranges.split(","):
+        m = _RANGE.match(r)
+        if not m:
+            raise ValueError(f"invalid range {r!r} in hostlist {name!r}")
+        first, last = m.group(1), m.group(2) or m.group(1)
+        for i in range(int(first), int(last) + 1):
+            hosts += [prefix + str(i).zfill(len(first)) + s for s in _expand_one(suffix)]
+    return hosts
+
+
+def read_conf(path: str) -> Tuple[str, Dict[str, str]]:
+    """AWS region and hostname -> instance id from slurm-power.conf."""
+    region, nodes = "", {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if fields[0] == "region":
+                region = fields[1]
+            elif fields[0] == "node":
+                nodes[fields[1]] = fields[2]
+    return region, nodes
+
+
+# ------------------------------------------------------------------------------
+# EC2
+# ------------------------------------------------------------------------------
+
+class AwsEc2:
+    """EC2 API through the AWS CLI."""
+
+    def __init__(self, region: str):
+        self.region = region
+
+    def _call(self, *args: str) -> Dict:
+        proc = subprocess.run(
+            ["aws", "--region", self.region, "--output", "json", "ec2", *args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        if proc.returncode != 0:
+            raise Ec2Error(proc.stderr.strip())
+        return json.loads(proc.stdout or "{}")
+
+    def start(self, ids: List[str]) -> None:
+        self._call("start-instances", "--instance-ids", *ids)
+
+    def stop(self, ids: List[str]) -> None:
+        self._call("stop-instances", "--instance-ids", *ids)
+
+    def states(self, ids: List[str]) -> Dict[str, str]:
+        out = self._call("describe-instances", "--instance-ids", *ids)
+        return {
+            i["InstanceId"]: i["State"]["Name"]
+            for r in out.get("Reservations", []) for i in r["Instances"]
+        }
+
+
+class LocalEc2:
+    """Stand-in for the EC2 API keeping instance id -> state in a JSON file.
+
+    Like EC2 it rejects unknown instance ids, and starting a running or
+    stopping a stopped instance is a no-op.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _update(self, ids: List[str], state: str) -> None:
+        with open(self.path, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            states = json.load(f)
+            unknown = [i for i in ids if i not in states]
+            if unknown:
+                raise Ec2Error(f"InvalidInstanceID.NotFound: {', '.join(unknown)}")
+            states.update({i: state for i in ids})
+            f.seek(0)
+            f.truncate()
+            json.dump(states, f, indent=2, sort_keys=True)
+
+    def start(self, ids: List[str]) -> None:
+        self._update(ids, "running")
+
+    def stop(self, ids: List[str]) -> None:
+        self._update(ids, "stopped")
+
+    def states(self, ids: List[str]) -> Dict[str, str]:
+        with open(self.path) as f:
+            states = json.load(f)
+        return {i: states[i] for i in ids if i in states}
+
+
+def ec2_client(region: str):
+    backend = os.environ.get("SLURM_POWER_EC2", "aws")
+    if backend.startswith("local:"):
+        return LocalEc2(backend[len("local:"):])
+    return AwsEc2(region)
+
+
+# ------------------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------------------
+
+def log(message: str) -> None:
+    line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {message}\n"
+    if LOG == "-":
+        sys.stdout.write(line)
+    else:
+        with open(LOG, "a") as f:
+            f.write(line)
+
+
+def power(action: str, hosts: List[str], nodes: Dict[str, str], ec2) -> bool:
+    """Start or stop the instances of `hosts`; False if any of them failed."""
+    ok = True
+    unknown = [h for h in hosts if h not in nodes]
+    if unknown:
+        log(f"{action}: no instance id for {', '.join(unknown)}")
+        ok = False
+    known = [h for h in hosts if h in nodes]
+    call = ec2.start if action == "resume" else ec2.stop
+    for i in range(0, len(known), BATCH):
+        batch = known[i:i + BATCH]
+        try:
+            call([nodes[h] for h in batch])
+            log(f"{action}: {' '.join(batch)}")
+        except Ec2Error as e:
+            log(f"{action} failed for {' '.join(batch)}: {e}")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=["resume", "suspend", "status"])
+    parser.add_argument("hostlist", nargs="?", help="Slurm hostlist (default for status: every node)")
+    args = parser.parse_args()
+
+    region, nodes = read_conf(CONF)
+    ec2 = ec2_client(region)
+    hosts = expand_hostlist(args.hostlist) if args.hostlist else sorted(nodes)
+    if args.action == "status":
+        states = ec2.states([nodes[h] for h in hosts if h in nodes])
+        for h in hosts:
+            print(f"{h:<24} {nodes.get(h, '-'):<22} {states.get(nodes.get(h), 'unknown')}")
+        return
+    if not args.hostlist:
+        parser.error(f"{args.action} needs a hostlist")
+    sys.exit(0 if power(args.action, hosts, nodes, ec2) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Node and partition section of slurm.conf, generated from the cluster topology."""
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Iterable, List, Tuple
+
+# Percentage of a node's memory that Slurm may hand out to jobs
+REAL_MEMORY_PERCENT = 95
+
+# Programs slurmctld runs to start and stop elastic compute nodes, see
+# server-side-files/slurm_power.py
+RESUME_PROGRAM = "/usr/local/sbin/slurm-resume"
+SUSPEND_PROGRAM = "/usr/local/sbin/slurm-suspend"
+
+# Where the nodes run Slurm from, per slurmInstall mode: straight from EFS
+# (shared), or from a copy on each node's disk that is synced from the build
+# staged on EFS and checked on every boot (local). The config stays on EFS.
+SLURM_HOMES = {
+    "shared": "/efs/slurm",
+    "local": "/opt/slurm/current",
+}
+
+# Names a node pool, and with it its partition and node names, may take
+POOL_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+_NUMBERED = re.compile(r"^(.*?)(\d+)$")
+
+
+def hostlist(hostnames: Iterable[str]) -> str:
+    """Compress hostnames into a Slurm hostlist expression.
+
+    Names ending in a number are grouped by the rest of the name and their
+    numbers folded into ranges, e.g. node001..node500 -> `node[001-500]`;
+    zero padding is kept as written. Other names are listed as they are.
+    """
+    prefixes = defaultdict(set)
+    plain = set()
+    for name in hostnames:
+        m = _NUMBERED.match(name)
+        if m:
+            prefixes[m.group(1)].add(m.group(2))
+        else:
+            plain.add(name)
+
+    parts = sorted(plain)
+    for prefix in sorted(prefixes):
+        # Numbers of different width can't share a range (node9, node10, node010)
+        numbers = sorted(prefixes[prefix], key=lambda s: (len(s), int(s)))
+        ranges = []
+        for _, run in groupby(enumerate(numbers), key=lambda x: (len(x[1]), int(x[1]) - x[0])):
+            run = [n for _, n in run]
+            ranges.append(run[0] if len(run) == 1 else f"{run[0]}-{run[-1]}")
+        if len(numbers) == 1:
+            parts.append(prefix + numbers[0])
+        else:
+            parts.append(f"{prefix}[{','.join(ranges)}]")
+    return ",".join(parts)
+
+
+@dataclass
+class Partition:
+    """Compute nodes of one size, exposed to jobs as a Slurm partition."""
+    name: str
+    hosts: List[str]
+    cpus: int
+    memory_mib: int
+    features: List[str] = field(default_factory=list)
+    default: bool = False
+
+    @property
+    def real_memory(self) -> int:
+        """MiB of a node's memory that Slurm hands out to jobs (RealMemory)."""
+        return self.memory_mib * REAL_MEMORY_PERCENT // 100
+
+
+def node_section(partitions: Iterable[Partition], elastic: bool = False) -> str:
+    """`NodeName`, `NodeSet` and `PartitionName` lines for `partitions`.
+
+    Nodes of the same size and features share one `NodeName` line. Elastic
+    nodes are registered as `CLOUD` nodes, which Slurm powers up and down.
+    """
+    state = "CLOUD" if elastic else "DOWN"
+    partitions = [p for p in partitions if p.hosts]
+    sizes = defaultdict(list)
+    for p in partitions:
+        sizes[(p.cpus, p.real_memory, ",".join(p.features))] += p.hosts
+
+    lines: List[str] = []
+    for (cpus, memory, features), hosts in sorted(sizes.items()):
+        feature = f" Features={features}" if features else ""
+        lines.append(f"NodeName={hostlist(hosts)} CPUs={cpus} RealMemory={memory}{feature} State={state}")
+    for p in partitions:
+        lines += [
+            f"NodeSet={p.name}_nodes Nodes={hostlist(p.hosts)}",
+            f"PartitionName={p.name} Nodes={p.name}_nodes MaxTime=INFINITE State=UP Default={'YES' if p.default else 'NO'}",
+        ]
+    return "\n".join(lines)
+
+
+def power_save_section(suspend_time: int) -> str:
+    """Power saving settings that stop idle elastic nodes and start them on demand.
+
+    Nodes idle for `suspend_time` seconds are stopped. A resumed node has
+    ResumeTimeout to boot and register its slurmd, otherwise it is marked down.
+    """
+    return "\n".join([
+        f"SuspendProgram={SUSPEND_PROGRAM}",
+        f"ResumeProgram={RESUME_PROGRAM}",
+        f"SuspendTime={suspend_time}",
+        "SuspendTimeout=180",
+        "ResumeTimeout=600",
+        # Nodes started and stopped per minute
+        "ResumeRate=50",
+        "SuspendRate=50",
+        # The nodes keep their hostname and address while stopped, and a node
+        # that was down before it got suspended is schedulable again
+        "SlurmctldParameters=idle_on_node_suspend,cloud_dns",
+        # List powered down nodes in sinfo (as idle~) instead of hiding them
+        "PrivateData=cloud",
+    ])
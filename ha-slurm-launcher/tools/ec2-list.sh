@@ -1,3 +1,7 @@
 #!/bin/bash
-
-aws ec2 describe-instance-types --filters Name=current-generation,Values=true | jq -c '.InstanceTypes | reduce .[] as $i ({}; .[$i.InstanceType] = { memory_in_mib: $i.MemoryInfo.SizeInMiB, vcpus: $i.VCpuInfo.DefaultVCpus})' | jq > ec2-list.csv
+# Refresh ec2-catalog.json with the current generation instance types of the
+# configured AWS region. To refresh offline, pass a saved dump instead:
+#   python ec2_catalog.py refresh --from describe-instance-types.json
+set -euo pipefail
+cd `dirname $0`/..
+python ec2_catalog.py refresh
@@ -0,0 +1,120 @@
+"""Cluster topology shared by every node of a deployment."""
+
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+
+import pulumi
+from pulumi_aws import ec2
+
+from ec2_catalog import Ec2Catalog
+from slurm_config import POOL_NAME, Partition, node_section
+
+
+def short_hostname(instance: ec2.Instance) -> pulumi.Output:
+    """Private DNS name of `instance` without the domain part."""
+    return instance.private_dns.apply(lambda host: host.split(".")[0])
+
+
+@dataclass
+class NodePool:
+    """Compute nodes of one instance type, exposed as one Slurm partition."""
+    name: str
+    instance_type: str
+    count: int
+    features: List[str] = field(default_factory=list)
+    default: bool = False
+
+    @classmethod
+    def from_config(cls, pools: Optional[List[Dict]], instance_type: str, count) -> List["NodePool"]:
+        """Pools from the `slurmComputeNodePools` config value.
+
+        Without it there is a single `all` pool of `count` nodes of
+        `instance_type` (slurmComputeNodeInstanceType/-ServerNumber). The first
+        pool is the default partition unless another one sets `default`.
+        """
+        if not pools:
+            return [cls("all", instance_type, int(count), default=True)]
+
+        result = [
+            cls(
+                name=p["name"],
+                instance_type=p["instanceType"],
+                count=int(p["count"]),
+                features=list(p.get("features", [])),
+                default=bool(p.get("default", False)),
+            )
+            for p in pools
+        ]
+        names = [p.name for p in result]
+        for name in names:
+            if not POOL_NAME.match(name):
+                raise ValueError(f"node pool name {name!r} may only contain letters, digits and underscores")
+            if names.count(name) > 1:
+                raise ValueError(f"node pool {name!r} is defined more than once")
+        if sum(p.default for p in result) > 1:
+            raise ValueError("only one node pool can be the default partition")
+        if not any(p.default for p in result):
+            result[0].default = True
+        return result
+
+    def partition(self, catalog: Ec2Catalog) -> Partition:
+        """Slurm partition of this pool (without hosts), sized from the EC2 instance catalog."""
+        instance = catalog.require(self.instance_type, setting=f"instanceType of node pool {self.name}")
+        return Partition(
+            name=self.name,
+            hosts=[],
+            cpus=instance.vcpus,
+            memory_mib=instance.memory_in_mib,
+            features=self.features,
+            default=self.default,
+        )
+
+
+@dataclass
+class ClusterTopology:
+    """Hostnames and compute partitions, built once per deployment.
+
+    The node lists are rendered in the `[[...]]` list form the server-side
+    justfile expects in SLURM_COMPUTE_NODES and WORKBENCH_NODES;
+    `slurm_nodes` is the node and partition section of slurm.conf and
+    `compute_instances` has a `node <hostname> <instance id>` line per
+    compute node, for the power saving programs of elastic clusters (None
+    for other clusters).
+    """
+    head_node: pulumi.Output
+    compute_nodes: pulumi.Output
+    workbench_nodes: pulumi.Output
+    slurm_nodes: pulumi.Output
+    compute_instances: Optional[pulumi.Output]
+
+    @classmethod
+    def build(
+        cls,
+        head_nodes: List[ec2.Instance],
+        compute_pools: List[Tuple[NodePool, List[ec2.Instance]]],
+        workbench_nodes: List[ec2.Instance],
+        catalog: Ec2Catalog,
+        elastic: bool = False,
+    ) -> "ClusterTopology":
+        partitions = [pool.partition(catalog) for pool, _ in compute_pools]
+        sizes = [len(nodes) for _, nodes in compute_pools]
+        compute_instances = [n for _, nodes in compute_pools for n in nodes]
+        compute_hostnames = pulumi.Output.all(*[short_hostname(n) for n in compute_instances])
+
+        def with_hosts(hosts: List[str]) -> List[Partition]:
+            offsets = [sum(sizes[:i]) for i in range(len(sizes))]
+            return [
+                replace(p, hosts=hosts[offset:offset + size])
+                for p, offset, size in zip(partitions, offsets, sizes)
+            ]
+
+        return cls(
+            head_node=short_hostname(head_nodes[0]),
+            compute_nodes=compute_hostnames.apply(lambda l: f"{[l]}"),
+            workbench_nodes=pulumi.Output.all([short_hostname(n) for n in workbench_nodes]).apply(lambda l: f"{l}"),
+            slurm_nodes=compute_hostnames.apply(lambda l: node_section(with_hosts(l), elastic)),
+            # Only elastic clusters need the instance ids on the nodes
+            compute_instances=pulumi.Output.all(compute_hostnames, *[n.id for n in compute_instances]).apply(
+                lambda x: "\n".join(f"node {host} {id}" for host, id in zip(x[0], x[1:]))
+            ) if elastic else None,
+        )